@@ -0,0 +1,65 @@
+"""
+Fetch and serialization time of a product_stats query, as per-row dicts vs columnar results.
+
+"rows" is the dict per row path (pool.query, then the JSON response encoder), "arrow" reads
+the ClickHouse Arrow format (pool.query_arrow) and serializes with api.lib.columnar, "numpy"
+only fetches (pool.query_np).
+
+Usage (from the repository root, with the usual API_CLICKHOUSE_* environment):
+    PYTHONPATH=$PWD uv run --directory api python -m api.benchmarks.columnar [rows]
+"""
+import asyncio
+import inspect
+import sys
+import time
+
+from api.lib import columnar
+from api.lib.db import close_connection, get_pool
+from api.lib.fastjson import dumps
+
+DEFAULT_ROWS = 100_000
+REPEAT = 5
+QUERY = "SELECT * FROM analytics.product_stats ORDER BY date_hour DESC LIMIT {rows:UInt32}"
+
+
+async def timed(call) -> tuple[float, object]:
+    started_at = time.perf_counter()
+    result = call()
+    if inspect.isawaitable(result):
+        result = await result
+    return time.perf_counter() - started_at, result
+
+
+async def best_of(name: str, fetch, serialize=None) -> None:
+    fetch_timings, serialize_timings, size = [], [], 0
+    for _ in range(REPEAT):
+        fetch_seconds, result = await timed(fetch)
+        fetch_timings.append(fetch_seconds)
+        if serialize is not None:
+            serialize_seconds, body = await timed(lambda: serialize(result))
+            serialize_timings.append(serialize_seconds)
+            size = len(body)
+    line = f"  {name:>12}: fetch {min(fetch_timings) * 1000:8.1f} ms"
+    if serialize_timings:
+        line += f", serialize {min(serialize_timings) * 1000:8.1f} ms ({size / 1e6:.1f} MB)"
+    print(line)
+
+
+async def main() -> None:
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+    pool = await get_pool()
+    parameters = {"rows": num_rows}
+    # large results must not hit the default timeout
+    timeout = 300
+
+    print(f"product_stats, {num_rows} rows, best of {REPEAT}")
+    await best_of("rows json", lambda: pool.query(QUERY, parameters, timeout), dumps)
+    await best_of("arrow json", lambda: pool.query_arrow(QUERY, parameters, timeout), columnar.to_json)
+    await best_of("arrow csv", lambda: pool.query_arrow(QUERY, parameters, timeout), columnar.to_csv)
+    await best_of("arrow ipc", lambda: pool.query_arrow(QUERY, parameters, timeout), columnar.to_arrow_ipc)
+    await best_of("numpy", lambda: pool.query_np(QUERY, parameters, timeout))
+    await close_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 """FastAPI application factory and setup."""
+import asyncio
 import logging
 
 from fastapi import FastAPI, Request
@@ -10,7 +11,8 @@ from clickhouse_connect.driver.exceptions import DatabaseError, InterfaceError
 from api.lib.config import settings
 from api.lib.middleware import limiter, rate_limit_handler
 from api.lib.exceptions import database_exception_handler, general_exception_handler
-from api.routes import health, revenue_summary
+from api.lib.fastjson import FastJSONResponse
+from api.routes import health, revenue_summary, timeseries
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,7 @@ def create_app() -> FastAPI:
         docs_url="/docs",
         redoc_url="/redoc",
         openapi_url="/openapi.json",
+        default_response_class=FastJSONResponse,
     )
 
     # Add rate limiter to app state
@@ -60,6 +63,7 @@ def create_app() -> FastAPI:
     # Include routers
     app.include_router(health.router)
     app.include_router(revenue_summary.router)
+    app.include_router(timeseries.router)
     
     # Modify OpenAPI schema to exclude /metrics endpoint
     # /health is already excluded via include_in_schema=False on the route
@@ -81,12 +85,20 @@ def create_app() -> FastAPI:
     
     app.openapi = custom_openapi
 
+    # Register startup event
+    @app.on_event("startup")
+    async def startup_event():
+        """Start the background refresh of the refresh-ahead cached routes."""
+        from api.lib.cache import refresh_loop
+        app.state.cache_refresh_task = asyncio.create_task(refresh_loop())
+
     # Register shutdown event
     @app.on_event("shutdown")
     async def shutdown_event():
         """Cleanup on application shutdown."""
+        app.state.cache_refresh_task.cancel()
         from api.lib.db import close_connection
-        close_connection()
+        await close_connection()
         logger.info("Application shutdown complete")
 
     return app
@@ -1,42 +1,379 @@
-"""Caching utilities with TTL and cache headers."""
+"""Caching utilities: server-side TTL and refresh-ahead response cache with cache headers."""
+import asyncio
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from functools import wraps
-from typing import Callable, Any
+from typing import Awaitable, Callable, Any, Dict, List, Optional, Set, Tuple
 
-from fastapi import Response
-from fastapi.responses import JSONResponse
+from cachetools import TLRUCache
+from fastapi import Request, Response, params
+from prometheus_client import Counter
 from pydantic import BaseModel
 
 from api.lib.config import settings
+from api.lib.fastjson import FastJSONResponse
 
+logger = logging.getLogger(__name__)
 
-def cached(ttl_seconds: int = None):
+# exposed on /metrics by the Instrumentator (default registry)
+CACHE_REQUESTS = Counter(
+    "api_cache_requests_total",
+    "Cached route lookups: hit, stale, miss (runs the query) or coalesced (waits for a concurrent miss)",
+    ["route", "result"],
+)
+CACHE_REFRESHES = Counter(
+    "api_cache_refreshes_total",
+    "Background refreshes of the refresh-ahead routes",
+    ["route", "result"],
+)
+
+
+@dataclass
+class CachedResponse:
+    """A rendered response body, as stored in the cache for `ttl` seconds."""
+    body: bytes
+    media_type: str
+    created_at: float
+    ttl: int
+    # Cache-Control max-age
+    max_age: int
+
+    def to_response(self, cache_status: str) -> Response:
+        response = Response(content=self.body, media_type=self.media_type)
+        response.headers["Cache-Control"] = f"public, max-age={self.max_age}"
+        response.headers["Age"] = str(max(int(time.time() - self.created_at), 0))
+        response.headers["X-Cache"] = cache_status
+        if cache_status == "STALE":
+            response.headers["Warning"] = '110 - "Response is Stale"'
+        return response
+
+
+class MemoryCache:
+    """In-process cache, entries expire after their own TTL and the least recently used are evicted first."""
+
+    def __init__(self, max_entries: int):
+        self._entries = TLRUCache(maxsize=max_entries, ttu=lambda _key, entry, now: now + entry.ttl, timer=time.time)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, entry: CachedResponse) -> None:
+        self._entries[key] = entry
+
+
+class RedisCache:
+    """Cache shared by the API workers in Redis, entries expire with their TTL (Redis evicts with its own policy)."""
+
+    def __init__(self, url: str):
+        # optional dependency, only required for API_CACHE_BACKEND=redis
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            fields = await self._redis.hgetall(key)
+        except Exception as e:
+            # an unavailable cache must not fail the API
+            logger.warning(f"Cache read failed: {e}")
+            return None
+        if not fields:
+            return None
+        return CachedResponse(
+            body=fields[b"body"],
+            media_type=fields[b"media_type"].decode(),
+            created_at=float(fields[b"created_at"]),
+            ttl=int(fields[b"ttl"]),
+            max_age=int(fields[b"max_age"]),
+        )
+
+    async def set(self, key: str, entry: CachedResponse) -> None:
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping={
+                    "body": entry.body,
+                    "media_type": entry.media_type,
+                    "created_at": entry.created_at,
+                    "ttl": entry.ttl,
+                    "max_age": entry.max_age,
+                })
+                pipe.expire(key, entry.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Cache write failed: {e}")
+
+
+_backend = None
+# cache misses being computed, concurrent misses on the same key wait for the same result
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+@dataclass
+class Refresher:
+    """A cached route result recomputed in the background (refresh-ahead)."""
+    func: Callable
+    kwargs: Dict[str, Any]
+    route: str
+    refresh_seconds: int
+    # tables the result is computed from, a change triggers a refresh
+    depends_on: Tuple[str, ...]
+    # route parameters resolved by their dependency (FastAPI Depends) on every refresh
+    dependencies: Dict[str, Callable]
+    next_refresh: float = 0.0
+    # time of the last request served from this result, unrequested results stop being refreshed
+    last_requested: float = 0.0
+
+    async def call(self) -> Any:
+        kwargs = dict(self.kwargs)
+        for name, dependency in self.dependencies.items():
+            value = dependency()
+            kwargs[name] = await value if inspect.isawaitable(value) else value
+        return await self.func(**kwargs)
+
+
+# least recently requested first, at most settings.CACHE_MAX_ENTRIES like the memory cache
+_refreshers: "OrderedDict[str, Refresher]" = OrderedDict()
+
+
+def _touch_refresher(key: str) -> bool:
+    """Mark the refresher of `key` as requested now, False if there is none."""
+    refresher = _refreshers.get(key)
+    if refresher is None:
+        return False
+    refresher.last_requested = time.time()
+    _refreshers.move_to_end(key)
+    return True
+
+
+def _add_refresher(key: str, refresher: Refresher) -> None:
+    """Add the refresher of `key`, evicting the least recently requested ones beyond the cache capacity."""
+    _refreshers[key] = refresher
+    while len(_refreshers) > settings.CACHE_MAX_ENTRIES:
+        evicted, _ = _refreshers.popitem(last=False)
+        logger.info(f"Evicted the refresh of {evicted}, least recently requested")
+
+
+def _expire_refreshers(now: float) -> None:
+    """Drop the refreshers whose result was not requested for settings.CACHE_STALE_TTL_SECONDS, their entry then expires from the cache."""
+    for key, refresher in list(_refreshers.items()):
+        if now - refresher.last_requested > settings.CACHE_STALE_TTL_SECONDS:
+            del _refreshers[key]
+
+
+def get_cache():
+    """Get or create the cache backend selected by settings.CACHE_BACKEND."""
+    global _backend
+    if _backend is None:
+        if settings.CACHE_BACKEND == "redis":
+            _backend = RedisCache(settings.CACHE_REDIS_URL)
+        else:
+            _backend = MemoryCache(settings.CACHE_MAX_ENTRIES)
+    return _backend
+
+
+def cache_key(route: str, arguments: Optional[Dict[str, Any]] = None) -> str:
+    """Route and its sorted parameter values."""
+    query = "&".join(f"{name}={value}" for name, value in sorted((arguments or {}).items()))
+    return f"api:{route}?{query}"
+
+
+def _key_parameters(func: Callable) -> Dict[str, Any]:
     """
-    Decorator to add cache headers to responses.
+    Parameters of a route that make up its cache key, with their default value (`inspect.Parameter.empty`
+    when required): the ones FastAPI binds from the request, minus the request or response objects
+    and the Depends dependencies.
+    """
+    parameters = {}
+    for name, parameter in inspect.signature(func).parameters.items():
+        if isinstance(parameter.default, params.Depends):
+            continue
+        if inspect.isclass(parameter.annotation) and issubclass(parameter.annotation, (Request, Response)):
+            continue
+        default = parameter.default
+        # Query(...), Path(...) and the like hold the actual default
+        if isinstance(default, params.Param):
+            default = inspect.Parameter.empty if default.is_required() else default.default
+        parameters[name] = default
+    return parameters
+
+
+def _render(result: Any, ttl: int, max_age: int) -> Optional[CachedResponse]:
+    """Render a route result, None if it cannot be cached (streamed responses)."""
+    if isinstance(result, Response):
+        if not hasattr(result, "body"):
+            return None
+        return CachedResponse(result.body, result.media_type or "application/octet-stream", time.time(), ttl, max_age)
+
+    # Convert Pydantic models to dict for JSON serialization
+    if isinstance(result, BaseModel):
+        result = result.model_dump()
+    response = FastJSONResponse(content=result)
+    return CachedResponse(response.body, response.media_type, time.time(), ttl, max_age)
+
+
+async def _single_flight(key: str, call: Callable[[], Awaitable[Any]], ttl: int, max_age: int) -> Tuple[Any, Optional[CachedResponse]]:
+    """Run `call` as the only computation of `key` and cache its rendered response, concurrent requests wait for it."""
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        result = await call()
+        entry = _render(result, ttl, max_age)
+        if entry is not None:
+            await get_cache().set(key, entry)
+        future.set_result(entry)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # retrieved here, so it is not logged when no request was waiting for it
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+    return result, entry
+
+
+def cached(ttl_seconds: int = None, refresh_seconds: int = None, depends_on: Tuple[str, ...] = ()):
+    """
+    Decorator caching the responses of a route server-side, and setting their cache headers.
+
+    Responses are cached per route and values of the route parameters (see `cache_key`) for
+    `ttl_seconds`: query parameters the route does not declare are not part of the key, so they
+    can not be used to bypass the cache.
+    Concurrent misses on the same key are coalesced, so only one of them runs the route.
+    The route must take a `request: Request` argument.
+
+    With `refresh_seconds` the route is refreshed ahead instead: each cached result is recomputed
+    in the background (see `refresh_loop`) every `refresh_seconds`, or as soon as one of the
+    `depends_on` tables changes, and kept for settings.CACHE_STALE_TTL_SECONDS, so requests are
+    always answered from the cache. A result older than twice `refresh_seconds` is served as stale.
+    Results are only refreshed while they are requested: a result not requested for
+    settings.CACHE_STALE_TTL_SECONDS is dropped, and at most settings.CACHE_MAX_ENTRIES results
+    (the least recently requested are evicted first) are refreshed.
+    The route must then work without its request (it is called with `request=None`), and its
+    dependencies must not depend on the request either (they are resolved again on every refresh).
 
     Args:
         ttl_seconds: Time to live in seconds (defaults to settings.CACHE_TTL_SECONDS)
+        refresh_seconds: Refresh-ahead interval in seconds
+        depends_on: Tables of the API database the result is computed from
     """
     def decorator(func: Callable) -> Callable:
+        route = func.__name__
+        route_id = f"{func.__module__}.{func.__qualname__}"
+        if refresh_seconds is None:
+            ttl = ttl_seconds or settings.CACHE_TTL_SECONDS
+            max_age = ttl
+        else:
+            ttl = settings.CACHE_STALE_TTL_SECONDS
+            max_age = refresh_seconds
+
+        # dependencies of the route, resolved by the refresh instead of reusing the request ones
+        dependencies = {
+            name: parameter.default.dependency
+            for name, parameter in inspect.signature(func).parameters.items()
+            if isinstance(parameter.default, params.Depends)
+        }
+
+        def register(key: str, kwargs: Dict[str, Any]) -> None:
+            if refresh_seconds is not None and not _touch_refresher(key):
+                _add_refresher(key, Refresher(
+                    func, {**kwargs, "request": None}, route, refresh_seconds, tuple(depends_on), dependencies,
+                    last_requested=time.time(),
+                ))
+
+        key_parameters = _key_parameters(func)
+
+        # with the default parameters, computed as soon as the refresh loop starts
+        if all(default is not inspect.Parameter.empty for default in key_parameters.values()):
+            register(cache_key(route_id, key_parameters), dict(key_parameters))
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            result = await func(*args, **kwargs)
-            
-            # If result is already a Response, add headers to it
-            if isinstance(result, Response):
-                ttl = ttl_seconds or settings.CACHE_TTL_SECONDS
-                result.headers["Cache-Control"] = f"public, max-age={ttl}"
+            arguments = {name: kwargs.get(name) for name in key_parameters}
+            key = cache_key(route_id, arguments)
+            cache = get_cache()
+
+            entry = await cache.get(key)
+            if entry is not None:
+                register(key, arguments)
+                if refresh_seconds is not None and time.time() - entry.created_at > 2 * refresh_seconds:
+                    CACHE_REQUESTS.labels(route=route, result="stale").inc()
+                    return entry.to_response("STALE")
+                CACHE_REQUESTS.labels(route=route, result="hit").inc()
+                return entry.to_response("HIT")
+
+            inflight = _inflight.get(key)
+            if inflight is not None:
+                CACHE_REQUESTS.labels(route=route, result="coalesced").inc()
+                await asyncio.wait([inflight])
+                if not inflight.cancelled():
+                    if inflight.exception() is not None:
+                        raise inflight.exception()
+                    if inflight.result() is not None:
+                        return inflight.result().to_response("HIT")
+                # the first request was cancelled, or its response is not cacheable
+                return await func(*args, **kwargs)
+
+            CACHE_REQUESTS.labels(route=route, result="miss").inc()
+            result, entry = await _single_flight(key, lambda: func(*args, **kwargs), ttl, max_age)
+            if entry is None:
                 return result
-            
-            # Convert Pydantic models to dict for JSON serialization
-            if isinstance(result, BaseModel):
-                result = result.model_dump()
-            
-            # Otherwise, wrap in JSONResponse with cache headers
-            ttl = ttl_seconds or settings.CACHE_TTL_SECONDS
-            response = JSONResponse(content=result)
-            response.headers["Cache-Control"] = f"public, max-age={ttl}"
-            return response
-        
+            register(key, arguments)
+            return entry.to_response("MISS")
+
         return wrapper
     return decorator
 
+
+async def _table_signatures(tables: List[str]) -> Dict[str, Tuple[Any, ...]]:
+    """Metadata modification time, rows and bytes of `tables`: moved by dbt table rebuilds and inserts."""
+    from api.lib.db import get_pool
+
+    pool = await get_pool()
+    rows = await pool.query(
+        """
+        SELECT name, metadata_modification_time, total_rows, total_bytes
+        FROM system.tables
+        WHERE database = currentDatabase() AND name IN {tables:Array(String)}
+        """,
+        {"tables": tables},
+    )
+    return {row["name"]: (row["metadata_modification_time"], row["total_rows"], row["total_bytes"]) for row in rows}
+
+
+async def refresh_loop() -> None:
+    """Recompute the refresh-ahead results that are due, or whose tables changed. Runs until cancelled."""
+    signatures: Dict[str, Tuple[Any, ...]] = {}
+    while True:
+        _expire_refreshers(time.time())
+        changed: Set[str] = set()
+        tables = sorted({table for refresher in _refreshers.values() for table in refresher.depends_on})
+        if tables:
+            try:
+                current = await _table_signatures(tables)
+                changed = {table for table, signature in current.items() if table in signatures and signatures[table] != signature}
+                signatures.update(current)
+            except Exception as e:
+                logger.warning(f"Could not check the cached tables for changes: {e}")
+
+        for key, refresher in list(_refreshers.items()):
+            now = time.time()
+            if now < refresher.next_refresh and not changed.intersection(refresher.depends_on):
+                continue
+            refresher.next_refresh = now + refresher.refresh_seconds
+            if key in _inflight:
+                continue
+            try:
+                await _single_flight(key, refresher.call, settings.CACHE_STALE_TTL_SECONDS, refresher.refresh_seconds)
+                CACHE_REFRESHES.labels(route=refresher.route, result="success").inc()
+            except Exception as e:
+                # the previous result is kept and served until it goes stale
+                logger.error(f"Refresh of {key} failed: {e}")
+                CACHE_REFRESHES.labels(route=refresher.route, result="error").inc()
+
+        await asyncio.sleep(settings.CACHE_REFRESH_TICK_SECONDS)
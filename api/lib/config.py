@@ -12,12 +12,32 @@ class Settings:
     CLICKHOUSE_USER: str = os.getenv("API_CLICKHOUSE_USER", "api")
     CLICKHOUSE_PASSWORD: str = os.getenv("API_CLICKHOUSE_PASSWORD", "")
     CLICKHOUSE_DB: str = os.getenv("API_CLICKHOUSE_DB", "analytics")
+    # Connection pool: concurrent queries, wait for a free connection, and idle time after which
+    # a connection is pinged before use
+    CLICKHOUSE_POOL_SIZE: int = int(os.getenv("API_CLICKHOUSE_POOL_SIZE", "8"))
+    CLICKHOUSE_POOL_ACQUIRE_TIMEOUT_SECONDS: float = float(os.getenv("API_CLICKHOUSE_POOL_ACQUIRE_TIMEOUT_SECONDS", "5"))
+    CLICKHOUSE_HEALTH_CHECK_INTERVAL_SECONDS: float = float(os.getenv("API_CLICKHOUSE_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+    # Default query timeout, also sent to ClickHouse as max_execution_time
+    CLICKHOUSE_QUERY_TIMEOUT_SECONDS: int = int(os.getenv("API_CLICKHOUSE_QUERY_TIMEOUT_SECONDS", "30"))
+    # Same, for the streamed responses
+    CLICKHOUSE_STREAM_TIMEOUT_SECONDS: int = int(os.getenv("API_CLICKHOUSE_STREAM_TIMEOUT_SECONDS", "300"))
 
     # Rate limiting configuration
     RATE_LIMIT_PER_MINUTE: int = int(os.getenv("API_RATE_LIMIT_PER_MINUTE", "100"))
 
     # Cache configuration
     CACHE_TTL_SECONDS: int = int(os.getenv("API_CACHE_TTL_SECONDS", "3600"))  # 1 hour
+    # Server-side response cache: memory (per process) or redis (shared, needs the redis extra)
+    CACHE_BACKEND: str = os.getenv("API_CACHE_BACKEND", "memory")
+    CACHE_MAX_ENTRIES: int = int(os.getenv("API_CACHE_MAX_ENTRIES", "1024"))
+    CACHE_REDIS_URL: str = os.getenv("API_CACHE_REDIS_URL", "redis://redis:6379/1")
+    # Refresh-ahead routes: results are kept this long while the refresh lags, and the refresh
+    # loop wakes up (and checks the tables the results depend on) at this interval
+    CACHE_STALE_TTL_SECONDS: int = int(os.getenv("API_CACHE_STALE_TTL_SECONDS", "86400"))
+    CACHE_REFRESH_TICK_SECONDS: int = int(os.getenv("API_CACHE_REFRESH_TICK_SECONDS", "10"))
+
+    # JSON encoder used for responses: orjson or json (stdlib)
+    JSON_BACKEND: str = os.getenv("API_JSON_BACKEND", "orjson")
 
     # API configuration
     API_HOST: str = os.getenv("API_HOST", "0.0.0.0")
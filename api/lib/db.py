@@ -1,72 +1,281 @@
-"""ClickHouse database connection and query helpers."""
+"""ClickHouse connection pool and query helpers."""
+import asyncio
 import logging
-from typing import Any, List, Dict, Optional
+import math
+import time
+from concurrent.futures import Executor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 
 import clickhouse_connect
-from clickhouse_connect.driver import Client
+import numpy as np
+import pyarrow as pa
+from clickhouse_connect.driver import AsyncClient
+from clickhouse_connect.driver.common import StreamContext
+from clickhouse_connect.driver.exceptions import OperationalError
+from clickhouse_connect.driver.httputil import get_pool_manager
 
 from api.lib.config import settings
 
 logger = logging.getLogger(__name__)
 
-_client: Optional[Client] = None
+# the client gives up this long after the server side max_execution_time, so the server error
+# (and a connection that can be reused) usually comes first
+_TIMEOUT_GRACE_SECONDS = 1.0
 
 
-def get_client() -> Client:
-    """Get or create ClickHouse client connection."""
-    global _client
-    if _client is None:
+@dataclass
+class _Connection:
+    client: AsyncClient
+    last_used: float
+
+
+class ClickHousePool:
+    """
+    Pool of `size` async ClickHouse clients, each with its own HTTP connection and worker thread.
+
+    Clients are created on first use, and pinged before being handed out when idle for more than
+    settings.CLICKHOUSE_HEALTH_CHECK_INTERVAL_SECONDS (and replaced when the ping fails). A client
+    whose query timed out or was cancelled is discarded, as its thread is still waiting on the server.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        # one connection per client, shared so the pool holds at most `size` connections
+        self._pool_manager = get_pool_manager(maxsize=size)
+        # None: slot without a client yet (or whose client was discarded)
+        self._slots: asyncio.Queue = asyncio.Queue()
+        for _ in range(size):
+            self._slots.put_nowait(None)
+
+    async def _connect(self) -> _Connection:
+        client = await clickhouse_connect.get_async_client(
+            host=settings.CLICKHOUSE_HOST,
+            port=settings.CLICKHOUSE_PORT,
+            username=settings.CLICKHOUSE_USER,
+            password=settings.CLICKHOUSE_PASSWORD,
+            database=settings.CLICKHOUSE_DB,
+            settings={"max_execution_time": settings.CLICKHOUSE_QUERY_TIMEOUT_SECONDS},
+            # sessions would serialize the queries of a client
+            autogenerate_session_id=False,
+            executor_threads=1,
+            pool_mgr=self._pool_manager,
+        )
+        logger.info(f"Connected to ClickHouse at {settings.CLICKHOUSE_HOST}:{settings.CLICKHOUSE_PORT}")
+        return _Connection(client, time.monotonic())
+
+    @staticmethod
+    def _discard(connection: _Connection) -> None:
+        # without waiting for a query still running in the client thread
+        connection.client.executor.shutdown(wait=False)
+        connection.client.client.close()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AsyncClient]:
+        """
+        Borrow a healthy client for the duration of the block.
+
+        Raises:
+            OperationalError: If no client is available within settings.CLICKHOUSE_POOL_ACQUIRE_TIMEOUT_SECONDS,
+                or ClickHouse cannot be reached
+        """
+        try:
+            connection = await asyncio.wait_for(self._slots.get(), settings.CLICKHOUSE_POOL_ACQUIRE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise OperationalError(f"No ClickHouse connection available after {settings.CLICKHOUSE_POOL_ACQUIRE_TIMEOUT_SECONDS}s")
+
+        try:
+            if connection is not None and time.monotonic() - connection.last_used > settings.CLICKHOUSE_HEALTH_CHECK_INTERVAL_SECONDS:
+                if not await connection.client.ping():
+                    logger.warning("ClickHouse connection failed its health check, reconnecting")
+                    self._discard(connection)
+                    connection = None
+            if connection is None:
+                connection = await self._connect()
+        except BaseException:
+            self._slots.put_nowait(connection)
+            raise
+
+        # query errors leave the client usable; timeouts, cancellations and closed streams
+        # may leave a query running in its thread
+        reusable = False
         try:
-            _client = clickhouse_connect.get_client(
-                host=settings.CLICKHOUSE_HOST,
-                port=settings.CLICKHOUSE_PORT,
-                username=settings.CLICKHOUSE_USER,
-                password=settings.CLICKHOUSE_PASSWORD,
-                database=settings.CLICKHOUSE_DB,
-            )
-            logger.info(
-                f"Connected to ClickHouse at {settings.CLICKHOUSE_HOST}:{settings.CLICKHOUSE_PORT}"
-            )
+            yield connection.client
+            reusable = True
         except Exception as e:
-            logger.error(f"Failed to connect to ClickHouse: {e}")
+            reusable = not isinstance(e, asyncio.TimeoutError)
             raise
-    return _client
+        finally:
+            if reusable:
+                connection.last_used = time.monotonic()
+                self._slots.put_nowait(connection)
+            else:
+                self._discard(connection)
+                self._slots.put_nowait(None)
 
+    async def _execute(self, method: str, query: str, parameters: Optional[Dict[str, Any]],
+                       timeout: Optional[float], **kwargs) -> Any:
+        """Run the AsyncClient `method`, sending the timeout to the server as max_execution_time."""
+        timeout = timeout or settings.CLICKHOUSE_QUERY_TIMEOUT_SECONDS
+        try:
+            async with self.acquire() as client:
+                return await asyncio.wait_for(
+                    getattr(client, method)(query, parameters=parameters, settings={"max_execution_time": math.ceil(timeout)}, **kwargs),
+                    timeout + _TIMEOUT_GRACE_SECONDS,
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"Query timed out after {timeout}s: {query}")
+            raise OperationalError(f"Query timed out after {timeout}s")
+        except Exception as e:
+            logger.error(f"Query execution failed: {e}")
+            logger.error(f"Query: {query}")
+            raise
 
-def execute_query(query: str, parameters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
-    """
-    Execute a query and return results as a list of dictionaries.
+    async def query(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                    timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Execute a query and return results as a list of dictionaries.
 
-    Args:
-        query: SQL query string
-        parameters: Optional query parameters
+        Args:
+            query: SQL query string
+            parameters: Optional query parameters
+            timeout: Seconds the query may run, sent to the server as max_execution_time
+                (defaults to settings.CLICKHOUSE_QUERY_TIMEOUT_SECONDS)
 
-    Returns:
-        List of dictionaries representing rows
+        Returns:
+            List of dictionaries representing rows
 
-    Raises:
-        Exception: If query execution fails
-    """
-    try:
-        client = get_client()
-        result = client.query(query, parameters=parameters)
-        # Convert result to list of dictionaries
+        Raises:
+            Exception: If query execution fails or times out
+        """
+        result = await self._execute("query", query, parameters, timeout)
         columns = result.column_names
-        rows = []
-        for row in result.result_rows:
-            rows.append(dict(zip(columns, row)))
-        return rows
-    except Exception as e:
-        logger.error(f"Query execution failed: {e}")
-        logger.error(f"Query: {query}")
-        raise
-
-
-def close_connection():
-    """Close the ClickHouse connection."""
-    global _client
-    if _client is not None:
-        _client.close()
-        _client = None
-        logger.info("ClickHouse connection closed")
+        return [dict(zip(columns, row)) for row in result.result_rows]
+
+    async def query_arrow(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                          timeout: Optional[float] = None) -> pa.Table:
+        """
+        Execute a query and return results as an Arrow table, read from the ClickHouse Arrow format
+        without building Python objects. Serialize it with `api.lib.columnar`.
+
+        Args and Raises: see `query`.
+        """
+        return await self._execute("query_arrow", query, parameters, timeout, use_strings=True)
+
+    async def query_np(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                       timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Execute a query and return results as a NumPy array (a structured array when the columns
+        have different types).
+
+        Args and Raises: see `query`.
+        """
+        return await self._execute("query_np", query, parameters, timeout)
+
+    @asynccontextmanager
+    async def _stream(self, method: str, query: str, parameters: Optional[Dict[str, Any]],
+                      timeout: Optional[float], **kwargs) -> AsyncIterator[Tuple[StreamContext, "BlockStream"]]:
+        """Open a stream with the AsyncClient `method`, holding the client until the block exits."""
+        timeout = timeout or settings.CLICKHOUSE_STREAM_TIMEOUT_SECONDS
+        try:
+            async with self.acquire() as client:
+                context = await asyncio.wait_for(
+                    getattr(client, method)(query, parameters=parameters, settings={"max_execution_time": math.ceil(timeout)}, **kwargs),
+                    timeout + _TIMEOUT_GRACE_SECONDS,
+                )
+                context.__enter__()
+                try:
+                    yield context, BlockStream(context, client.executor, timeout + _TIMEOUT_GRACE_SECONDS)
+                finally:
+                    # in the client thread, after the block it may still be reading
+                    client.executor.submit(context.__exit__, None, None, None)
+        except asyncio.TimeoutError:
+            logger.error(f"Query timed out after {timeout}s: {query}")
+            raise OperationalError(f"Query timed out after {timeout}s")
+        except Exception as e:
+            logger.error(f"Query execution failed: {e}")
+            logger.error(f"Query: {query}")
+            raise
+
+    @asynccontextmanager
+    async def query_arrow_stream(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                                 timeout: Optional[float] = None) -> AsyncIterator["BlockStream"]:
+        """
+        Stream the results of a query as Arrow record batches, one ClickHouse block at a time.
+
+        Args:
+            query: SQL query string
+            parameters: Optional query parameters
+            timeout: Seconds the query may run, sent to the server as max_execution_time
+                (defaults to settings.CLICKHOUSE_STREAM_TIMEOUT_SECONDS)
+
+        Raises:
+            Exception: If query execution fails or times out
+        """
+        async with self._stream("query_arrow_stream", query, parameters, timeout, use_strings=True) as (context, blocks):
+            blocks.schema = context.gen.schema
+            blocks.column_names = blocks.schema.names
+            yield blocks
+
+    @asynccontextmanager
+    async def query_row_block_stream(self, query: str, parameters: Optional[Dict[str, Any]] = None,
+                                     timeout: Optional[float] = None) -> AsyncIterator["BlockStream"]:
+        """
+        Stream the results of a query as blocks of row tuples.
+
+        Args and Raises: see `query_arrow_stream`.
+        """
+        async with self._stream("query_row_block_stream", query, parameters, timeout) as (context, blocks):
+            blocks.column_names = list(context.source.column_names)
+            yield blocks
+
+    async def close(self) -> None:
+        """Close the idle clients, clients still in use are closed with the connection pool."""
+        while not self._slots.empty():
+            connection = self._slots.get_nowait()
+            if connection is not None:
+                await connection.client.close()
+        self._pool_manager.clear()
+
+
+class BlockStream:
+    """Async iterator over the blocks of a streamed query, each read in the thread of its client."""
+
+    def __init__(self, context: StreamContext, executor: Executor, block_timeout: float):
+        self._context = context
+        self._executor = executor
+        self._block_timeout = block_timeout
+        self.column_names: List[str] = []
+        # Arrow streams only
+        self.schema: Optional[pa.Schema] = None
+
+    def __aiter__(self) -> "BlockStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        loop = asyncio.get_running_loop()
+        block = await asyncio.wait_for(loop.run_in_executor(self._executor, next, self._context, None), self._block_timeout)
+        if block is None:
+            raise StopAsyncIteration
+        return block
+
+
+_pool: Optional[ClickHousePool] = None
+
+
+async def get_pool() -> ClickHousePool:
+    """Get or create the ClickHouse pool, sized by settings.CLICKHOUSE_POOL_SIZE. Used as a route dependency."""
+    global _pool
+    if _pool is None:
+        _pool = ClickHousePool(settings.CLICKHOUSE_POOL_SIZE)
+    return _pool
+
 
+async def close_connection():
+    """Close the ClickHouse connection pool."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        logger.info("ClickHouse connection pool closed")
@@ -0,0 +1,65 @@
+"""Fast JSON encoding for API responses."""
+import json
+import logging
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable
+
+import numpy as np
+from fastapi.responses import JSONResponse
+
+from api.lib.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _default(obj: Any) -> Any:
+    """Serialize types the fast encoders don't handle natively."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, datetime) and obj.utcoffset() == timedelta(0):
+        # UTC as "Z", like orjson with OPT_UTC_Z and the CSV / Arrow timestamps (see api.lib.columnar)
+        return obj.replace(tzinfo=None).isoformat() + "Z"
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    # columns of the columnar results (serialized natively by orjson)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _orjson_dumps() -> Callable[[Any], bytes]:
+    import orjson
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z
+    return lambda content: orjson.dumps(content, default=_default, option=options)
+
+
+def _stdlib_dumps() -> Callable[[Any], bytes]:
+    return lambda content: json.dumps(
+        content,
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _get_dumps(backend: str) -> Callable[[Any], bytes]:
+    if backend == "orjson":
+        try:
+            return _orjson_dumps()
+        except ImportError:
+            logger.warning("orjson is not installed, falling back to the stdlib json module")
+    elif backend != "json":
+        raise ValueError(f"Unknown JSON backend {backend}, expected orjson or json")
+    return _stdlib_dumps()
+
+
+dumps = _get_dumps(settings.JSON_BACKEND)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the configured fast JSON backend."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,155 @@
+"""Streamed responses of large query results: NDJSON, CSV or Arrow IPC (or buffered column oriented JSON), negotiated with the Accept header."""
+import io
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+import pyarrow as pa
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from api.lib.columnar import ARROW_STREAM_MEDIA_TYPE, CSV_MEDIA_TYPE, JSON_MEDIA_TYPE, ColumnarResponse, to_csv
+from api.lib.db import ClickHousePool
+from api.lib.fastjson import dumps
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# the first one is used when any is accepted
+STREAM_MEDIA_TYPES = (NDJSON_MEDIA_TYPE, CSV_MEDIA_TYPE, ARROW_STREAM_MEDIA_TYPE)
+# plus column oriented JSON, not streamed: the result is read at once (see api.lib.columnar)
+RESPONSE_MEDIA_TYPES = (*STREAM_MEDIA_TYPES, JSON_MEDIA_TYPE)
+
+
+def _media_ranges(accept: str) -> List[Tuple[str, float]]:
+    """(media range, quality) of an Accept header."""
+    ranges = []
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip().lower() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((media_type, quality))
+    return ranges
+
+
+def _quality(media_type: str, ranges: List[Tuple[str, float]]) -> float:
+    """Quality of `media_type`, given by its most specific media range: type/subtype, then type/*, then */*."""
+    best_specificity, quality = -1, 0.0
+    for media_range, range_quality in ranges:
+        if media_range == media_type:
+            specificity = 2
+        elif media_range.endswith("/*") and media_type.startswith(media_range[:-1]):
+            specificity = 1
+        elif media_range == "*/*":
+            specificity = 0
+        else:
+            continue
+        if specificity > best_specificity:
+            best_specificity, quality = specificity, range_quality
+    return quality
+
+
+def negotiate(accept: Optional[str], supported: Sequence[str] = STREAM_MEDIA_TYPES) -> str:
+    """
+    Media type of `supported` with the highest quality in the Accept header, the first one
+    for a missing header or */*. A media type excluded with q=0 is never picked, even when a
+    wildcard accepts it (e.g. "*/*, application/x-ndjson;q=0").
+
+    Raises:
+        HTTPException: 406 if none of `supported` is accepted
+    """
+    if not accept:
+        return supported[0]
+    ranges = _media_ranges(accept)
+    best, best_quality = None, 0.0
+    for media_type in supported:
+        quality = _quality(media_type, ranges)
+        if quality > best_quality:
+            best, best_quality = media_type, quality
+    if best is None:
+        raise HTTPException(status_code=406, detail=f"Supported media types: {', '.join(supported)}")
+    return best
+
+
+async def _ndjson(pool: ClickHousePool, query: str, parameters: Optional[Dict[str, Any]], timeout: Optional[float]) -> AsyncIterator[bytes]:
+    async with pool.query_row_block_stream(query, parameters, timeout) as blocks:
+        columns = blocks.column_names
+        async for block in blocks:
+            yield b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in block)
+
+
+async def _csv(pool: ClickHousePool, query: str, parameters: Optional[Dict[str, Any]], timeout: Optional[float]) -> AsyncIterator[bytes]:
+    async with pool.query_arrow_stream(query, parameters, timeout) as batches:
+        yield to_csv(batches.schema.empty_table())
+        async for batch in batches:
+            yield to_csv(pa.Table.from_batches([batch]), include_header=False)
+
+
+def _drain(sink: io.BytesIO) -> bytes:
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
+
+
+async def _arrow_ipc(pool: ClickHousePool, query: str, parameters: Optional[Dict[str, Any]], timeout: Optional[float]) -> AsyncIterator[bytes]:
+    async with pool.query_arrow_stream(query, parameters, timeout) as batches:
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, batches.schema) as writer:
+            yield _drain(sink)
+            async for batch in batches:
+                writer.write_batch(batch)
+                yield _drain(sink)
+        # end of stream marker
+        yield _drain(sink)
+
+
+_WRITERS: Dict[str, Callable[..., AsyncIterator[bytes]]] = {
+    NDJSON_MEDIA_TYPE: _ndjson,
+    CSV_MEDIA_TYPE: _csv,
+    ARROW_STREAM_MEDIA_TYPE: _arrow_ipc,
+}
+
+
+async def _prepend(first: bytes, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    try:
+        yield first
+        async for chunk in body:
+            yield chunk
+    finally:
+        await body.aclose()
+
+
+async def stream_response(request: Request, pool: ClickHousePool, query: str,
+                          parameters: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> Response:
+    """
+    Stream the results of `query` in the format negotiated from the Accept header.
+
+    Results are read one ClickHouse block at a time (rows for NDJSON, Arrow record batches for
+    CSV and Arrow IPC), and each block is sent before the next one is read, so memory does not
+    grow with the result. The query is started before the response: its errors (and timeouts
+    waiting for a connection) are returned as error responses. Errors once the response started
+    abort it, the body is then truncated.
+
+    application/json is the exception: the result is read as a single Arrow table and rendered
+    as column oriented JSON (see `ColumnarResponse`), for clients wanting a single document.
+
+    Args:
+        request: Request, for its Accept header
+        pool: ClickHouse pool, the streamed query holds one of its clients until the end of the response
+        query: SQL query string
+        parameters: Optional query parameters
+        timeout: Seconds the query may run (defaults to settings.CLICKHOUSE_STREAM_TIMEOUT_SECONDS)
+    """
+    media_type = negotiate(request.headers.get("accept"), RESPONSE_MEDIA_TYPES)
+    headers = {"Vary": "Accept"}
+    if media_type == JSON_MEDIA_TYPE:
+        return ColumnarResponse(await pool.query_arrow(query, parameters, timeout), headers=headers)
+    body = _WRITERS[media_type](pool, query, parameters, timeout)
+    try:
+        first = await body.__anext__()
+    except StopAsyncIteration:
+        return Response(content=b"", media_type=media_type, headers=headers)
+    return StreamingResponse(_prepend(first, body), media_type=media_type, headers=headers)
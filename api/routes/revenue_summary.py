@@ -2,11 +2,11 @@
 from decimal import Decimal
 from typing import Any
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel, Field, field_validator
 
 from api.lib.config import settings
-from api.lib.db import execute_query
+from api.lib.db import ClickHousePool, get_pool
 from api.lib.middleware import limiter
 from api.lib.cache import cached
 
@@ -36,9 +36,9 @@ class RevenueSummaryResponse(BaseModel):
     description="Returns daily aggregation of revenue, yield, and BIFI buyback metrics for the last 30 days",
 )
 @limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
-@cached()
-async def get_revenue_summary(request: Request):
-    rows = execute_query("SELECT * FROM analytics.api_revenue_summary")
+@cached(refresh_seconds=300, depends_on=("daily_revenue_summary",))
+async def get_revenue_summary(request: Request, db: ClickHousePool = Depends(get_pool)):
+    rows = await db.query("SELECT * FROM analytics.api_revenue_summary")
     if not rows or not rows[0]:
         return RevenueSummaryResponse(
             revenue_usd_30d=0.0,
@@ -0,0 +1,112 @@
+"""Time series routes, streamed (see api.lib.streaming)."""
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Query, Request
+
+from api.lib.config import settings
+from api.lib.db import ClickHousePool, get_pool
+from api.lib.middleware import limiter
+from api.lib.streaming import RESPONSE_MEDIA_TYPES, stream_response
+
+router = APIRouter(prefix="/api/v1", tags=["timeseries"])
+
+STREAM_RESPONSES: Dict[int | str, Dict[str, Any]] = {
+    200: {
+        "description": "Rows streamed as NDJSON (default), CSV or an Arrow IPC stream, or column oriented JSON (not streamed), selected with the Accept header",
+        "content": {media_type: {} for media_type in RESPONSE_MEDIA_TYPES},
+    },
+    406: {"description": "None of the accepted media types is supported"},
+}
+
+
+def _where(filters: List[Tuple[str, str, str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    """
+    WHERE clause and parameters of the (column, operator, ClickHouse type, value) filters whose value is set.
+
+    The DateTime parameters are bound as naive UTC: timezone aware datetimes (e.g. ?start=...+02:00)
+    are converted to UTC first, naive ones are taken as UTC.
+    """
+    conditions, parameters = [], {}
+    for column, operator, type_, value in filters:
+        if value is None:
+            continue
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        name = f"p{len(parameters)}"
+        conditions.append(f"{column} {operator} {{{name}:{type_}}}")
+        parameters[name] = value
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), parameters
+
+
+@router.get(
+    "/product-stats",
+    summary="Stream hourly product stats",
+    description="Returns the hourly TVL, APY and fees of the products, ordered by hour",
+    responses=STREAM_RESPONSES,
+)
+@limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
+async def get_product_stats(
+    request: Request,
+    chain_id: Optional[int] = Query(None, description="Only this chain"),
+    product_address: Optional[str] = Query(None, description="Only this product"),
+    start: Optional[datetime] = Query(None, description="From this hour (inclusive)"),
+    end: Optional[datetime] = Query(None, description="Until this hour (exclusive)"),
+    db: ClickHousePool = Depends(get_pool),
+):
+    where, parameters = _where([
+        ("chain_id", "=", "Int64", chain_id),
+        ("product_address", "=", "String", product_address),
+        ("date_hour", ">=", "DateTime", start),
+        ("date_hour", "<", "DateTime", end),
+    ])
+    query = f"SELECT * FROM analytics.product_stats {where} ORDER BY date_hour, chain_id, product_address"
+    return await stream_response(request, db, query, parameters)
+
+
+@router.get(
+    "/chain-stats",
+    summary="Stream hourly chain stats",
+    description="Returns the hourly TVL, average yields and fee quantiles of the chains, ordered by hour",
+    responses=STREAM_RESPONSES,
+)
+@limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
+async def get_chain_stats(
+    request: Request,
+    chain_id: Optional[int] = Query(None, description="Only this chain"),
+    start: Optional[datetime] = Query(None, description="From this hour (inclusive)"),
+    end: Optional[datetime] = Query(None, description="Until this hour (exclusive)"),
+    db: ClickHousePool = Depends(get_pool),
+):
+    where, parameters = _where([
+        ("chain_id", "=", "Int64", chain_id),
+        ("date_hour", ">=", "DateTime", start),
+        ("date_hour", "<", "DateTime", end),
+    ])
+    query = f"SELECT * FROM analytics.chain_stats {where} ORDER BY date_hour, chain_id"
+    return await stream_response(request, db, query, parameters)
+
+
+@router.get(
+    "/investors/{account_id}/timeline",
+    summary="Stream the timeline of an investor",
+    description="Returns the deposits, withdrawals and balances of an investor per product, ordered by time",
+    responses=STREAM_RESPONSES,
+)
+@limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
+async def get_investor_timeline(
+    request: Request,
+    account_id: str,
+    product_address: Optional[str] = Query(None, description="Only this product"),
+    start: Optional[datetime] = Query(None, description="From this time (inclusive)"),
+    end: Optional[datetime] = Query(None, description="Until this time (exclusive)"),
+    db: ClickHousePool = Depends(get_pool),
+):
+    where, parameters = _where([
+        ("account_id", "=", "String", account_id),
+        ("product_address", "=", "String", product_address),
+        ("datetime", ">=", "DateTime64(3)", start),
+        ("datetime", "<", "DateTime64(3)", end),
+    ])
+    query = f"SELECT * FROM analytics.investor_timeline {where} ORDER BY datetime, product_address"
+    return await stream_response(request, db, query, parameters)
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from fastapi import Request
+
+from api.lib import cache
+from api.lib.cache import MemoryCache, cached
+
+
+@pytest.fixture(autouse=True)
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(cache, "_backend", MemoryCache(16))
+    monkeypatch.setattr(cache, "_inflight", {})
+
+
+def slow_route(error=None):
+    """A cached route counting its calls, each answering (or raising `error`) once its release event is set."""
+    calls = []
+
+    @cached(ttl_seconds=60)
+    async def route(request: Request, chain_id: int = 1):
+        calls.append(chain_id)
+        await route.release.wait()
+        if error is not None:
+            raise error
+        return {"chain_id": chain_id}
+
+    return route, calls
+
+
+async def concurrently(route, count, **kwargs):
+    """Call `route` `count` times at once, releasing it once they are all waiting."""
+    route.release = asyncio.Event()
+    requests = [asyncio.create_task(route(request=None, **kwargs)) for _ in range(count)]
+    await asyncio.sleep(0)
+    route.release.set()
+    return await asyncio.gather(*requests, return_exceptions=True)
+
+
+def cache_key_of(route, chain_id):
+    return cache.cache_key(f"{route.__module__}.{route.__qualname__}", {"chain_id": chain_id})
+
+
+def test_concurrent_misses_run_the_route_once():
+    route, calls = slow_route()
+
+    async def main():
+        responses = await concurrently(route, 3, chain_id=10)
+        return responses, await route(request=None, chain_id=10)
+
+    responses, hit = asyncio.run(main())
+
+    assert calls == [10]
+    assert sorted(response.headers["X-Cache"] for response in responses) == ["HIT", "HIT", "MISS"]
+    assert {response.body for response in responses} == {b'{"chain_id":10}'}
+    assert hit.headers["X-Cache"] == "HIT"
+    assert cache._inflight == {}
+
+
+def test_concurrent_misses_share_the_route_error():
+    route, calls = slow_route(error=ValueError("query failed"))
+
+    async def main():
+        return await concurrently(route, 3), await concurrently(route, 1)
+
+    errors, retry = asyncio.run(main())
+
+    assert [type(error) for error in errors] == [ValueError] * 3
+    # errors are not cached, the next request runs the route again
+    assert len(calls) == 2
+    assert type(retry[0]) is ValueError
+    assert cache._inflight == {}
+
+
+def test_refreshers_are_bounded_and_expire(monkeypatch):
+    monkeypatch.setattr(cache, "_refreshers", cache.OrderedDict())
+    monkeypatch.setattr(cache.settings, "CACHE_MAX_ENTRIES", 2)
+    monkeypatch.setattr(cache.settings, "CACHE_STALE_TTL_SECONDS", 60)
+
+    @cached(refresh_seconds=10)
+    async def route(request: Request, chain_id: int):
+        return {"chain_id": chain_id}
+
+    async def main():
+        for chain_id in (1, 2, 1, 3):
+            await route(request=None, chain_id=chain_id)
+
+    asyncio.run(main())
+
+    # chain 2 was the least recently requested
+    assert list(cache._refreshers) == [cache_key_of(route, 1), cache_key_of(route, 3)]
+
+    cache._refreshers[cache_key_of(route, 1)].last_requested -= 120
+    cache._expire_refreshers(cache.time.time())
+    assert list(cache._refreshers) == [cache_key_of(route, 3)]
+
+
+def test_late_refresh_is_served_stale(monkeypatch):
+    monkeypatch.setattr(cache, "_refreshers", cache.OrderedDict())
+
+    @cached(refresh_seconds=10)
+    async def route(request: Request, chain_id: int):
+        return {"chain_id": chain_id}
+
+    async def main():
+        await route(request=None, chain_id=1)
+        entry = await cache.get_cache().get(cache_key_of(route, 1))
+        entry.created_at -= 30
+        return await route(request=None, chain_id=1)
+
+    response = asyncio.run(main())
+
+    assert response.headers["X-Cache"] == "STALE"
+    assert response.body == b'{"chain_id":1}'
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+from clickhouse_connect.driver.exceptions import OperationalError
+
+from api.lib import db
+from api.lib.db import ClickHousePool
+
+
+class Result:
+    column_names = ["value"]
+    result_rows = [(1,)]
+
+
+class FakeClient:
+    """The AsyncClient members used by ClickHousePool, its `query` answering after `delay` seconds."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.discarded = False
+        self.executor = self
+        self.client = self
+
+    async def query(self, query, parameters=None, settings=None):
+        await asyncio.sleep(self.delay)
+        return Result()
+
+    # executor.shutdown and client.close, called when the pool discards the client
+    def shutdown(self, wait=True):
+        self.discarded = True
+
+    def close(self):
+        pass
+
+
+class FakePool(ClickHousePool):
+    """A pool of one slot, connecting the given clients in turn."""
+
+    def __init__(self, *clients):
+        super().__init__(1)
+        self.clients = list(clients)
+
+    async def _connect(self):
+        return db._Connection(self.clients.pop(0), time.monotonic())
+
+
+@pytest.fixture(autouse=True)
+def no_grace(monkeypatch):
+    monkeypatch.setattr(db, "_TIMEOUT_GRACE_SECONDS", 0)
+
+
+def test_timed_out_query_frees_its_slot():
+    slow, fast = FakeClient(delay=10), FakeClient()
+    pool = FakePool(slow, fast)
+
+    async def main():
+        with pytest.raises(OperationalError):
+            await pool.query("SELECT sleep(10)", timeout=0.05)
+        return await pool.query("SELECT 1")
+
+    rows = asyncio.run(main())
+
+    # the timed out client may still be running its query, it is replaced by a new one
+    assert slow.discarded
+    assert rows == [{"value": 1}]
+    assert not fast.discarded
+    assert pool._slots.qsize() == 1
+
+
+def test_client_is_reused_after_a_query():
+    client = FakeClient()
+    pool = FakePool(client)
+
+    async def main():
+        await pool.query("SELECT 1")
+        return await pool.query("SELECT 1")
+
+    assert asyncio.run(main()) == [{"value": 1}]
+    assert not client.discarded
@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import httpx
+import pyarrow as pa
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+
+from api.lib.streaming import negotiate, stream_response
+
+TABLE = pa.table({
+    "date_hour": pa.array([datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 1, 1, tzinfo=timezone.utc)], pa.timestamp("s", tz="UTC")),
+    "chain_id": pa.array([1, 10], pa.int64()),
+    "tvl": pa.array([1.5, None], pa.float64()),
+})
+
+
+class Stream:
+    def __init__(self, blocks, **attributes):
+        self._blocks = iter(blocks)
+        self.__dict__.update(attributes)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._blocks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakePool:
+    """The ClickHousePool query methods used by stream_response, answered from TABLE."""
+
+    async def query_arrow(self, query, parameters=None, timeout=None):
+        return TABLE
+
+    @asynccontextmanager
+    async def query_arrow_stream(self, query, parameters=None, timeout=None):
+        yield Stream(TABLE.to_batches(max_chunksize=1), schema=TABLE.schema)
+
+    @asynccontextmanager
+    async def query_row_block_stream(self, query, parameters=None, timeout=None):
+        rows = [tuple(row.values()) for row in TABLE.to_pylist()]
+        yield Stream([rows[:1], rows[1:]], column_names=TABLE.column_names)
+
+
+app = FastAPI()
+
+
+@app.get("/stats")
+async def stats(request: Request):
+    return await stream_response(request, FakePool(), "SELECT 1")
+
+
+def get(accept=None):
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get("/stats", headers={"Accept": accept} if accept else {})
+
+    return asyncio.run(main())
+
+
+def test_json_is_column_oriented():
+    response = get("application/json")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == {
+        "date_hour": ["2024-01-01T00:00:00Z", "2024-01-01T01:00:00Z"],
+        "chain_id": [1, 10],
+        "tvl": [1.5, None],
+    }
+
+
+def test_default_is_ndjson():
+    response = get()
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert len(response.text.splitlines()) == 2
+
+
+def test_ndjson_timestamps_match_csv():
+    ndjson = get("application/x-ndjson").text.splitlines()
+    csv = get("text/csv").text.splitlines()
+
+    assert ndjson[0] == '{"date_hour":"2024-01-01T00:00:00Z","chain_id":1,"tvl":1.5}'
+    assert csv[1].startswith('"2024-01-01T00:00:00Z",1,')
+
+
+@pytest.mark.parametrize("accept, expected", [
+    ("*/*", "application/x-ndjson"),
+    ("*/*, application/x-ndjson;q=0", "text/csv"),
+    ("application/*;q=0.5, application/x-ndjson;q=0, text/csv;q=0", "application/vnd.apache.arrow.stream"),
+    ("text/csv;q=0.5, application/vnd.apache.arrow.stream", "application/vnd.apache.arrow.stream"),
+])
+def test_negotiate(accept, expected):
+    assert negotiate(accept) == expected
+
+
+def test_negotiate_all_excluded():
+    with pytest.raises(HTTPException) as error:
+        negotiate("*/*, application/*;q=0, text/csv;q=0")
+    assert error.value.status_code == 406
+
+
+def test_not_acceptable():
+    assert get("text/html").status_code == 406
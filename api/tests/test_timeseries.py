@@ -0,0 +1,15 @@
+from datetime import datetime, timedelta, timezone
+
+from api.routes.timeseries import _where
+
+
+def test_where_binds_datetimes_as_utc():
+    start = datetime(2024, 1, 1, 2, tzinfo=timezone(timedelta(hours=2)))
+    where, parameters = _where([
+        ("chain_id", "=", "Int64", None),
+        ("date_hour", ">=", "DateTime", start),
+        ("date_hour", "<", "DateTime", datetime(2024, 1, 2)),
+    ])
+
+    assert where == "WHERE date_hour >= {p0:DateTime} AND date_hour < {p1:DateTime}"
+    assert parameters == {"p0": datetime(2024, 1, 1), "p1": datetime(2024, 1, 2)}
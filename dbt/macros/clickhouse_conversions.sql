@@ -56,6 +56,11 @@
     toFloat64({{ value }})
 {%- endmacro %}
 
+{% macro to_float_or_null(value) %}
+    {#- Float64 from a String or a numeric column alike, NULL when it does not parse -#}
+    toFloat64OrNull(toString({{ value }}))
+{%- endmacro %}
+
 {% macro if_null(value, default_value) %}
     case 
         when {{ value }} is null then {{ default_value }} 
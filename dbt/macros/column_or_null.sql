@@ -0,0 +1,9 @@
+{#- `column` of `relation`, or a typed NULL when the relation does not have it (dlt variant columns only exist once a value needed them) -#}
+{% macro column_or_null(relation, column, data_type='Nullable(String)') -%}
+    {%- set columns = adapter.get_columns_in_relation(relation) | map(attribute='name') | list if execute else [] -%}
+    {%- if column in columns -%}
+        {{ adapter.quote(column) }}
+    {%- else -%}
+        cast(NULL as {{ data_type }})
+    {%- endif -%}
+{%- endmacro %}
@@ -0,0 +1,17 @@
+{#- dbt's default query comment, plus the invocation_id: the dbt scheduler telemetry attributes system.query_log entries to the models of a run with it -#}
+{% macro query_comment_with_invocation(node) -%}
+    {%- set comment_dict = {} -%}
+    {%- do comment_dict.update(
+        app='dbt',
+        dbt_version=dbt_version,
+        profile_name=target.get('profile_name'),
+        target_name=target.get('target_name'),
+        invocation_id=invocation_id,
+    ) -%}
+    {%- if node is not none -%}
+        {%- do comment_dict.update(node_id=node.unique_id) -%}
+    {%- else -%}
+        {%- do comment_dict.update(connection_name=connection_name) -%}
+    {%- endif -%}
+    {{ return(tojson(comment_dict)) }}
+{%- endmacro %}
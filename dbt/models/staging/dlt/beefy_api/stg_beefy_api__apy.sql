@@ -5,10 +5,10 @@
 }}
 
 SELECT
-  toFloat64(t.apy) as apy,
+  {{ to_float_or_null('t.apy') }} as apy,
   cast(t.etag as String) as etag,
   cast(t.vault_id as String) as vault_id,
   cast(t.date_time as DateTime('UTC')) as date_time,
-  t.apy__v_text
+  {{ column_or_null(source('dlt', 'beefy_api___apy'), 'apy__v_text') }} as apy__v_text
 FROM {{ source('dlt', 'beefy_api___apy') }} t
-where t.apy is not null
+where {{ to_float_or_null('t.apy') }} is not null
@@ -7,7 +7,7 @@
 SELECT
   cast(t.etag as String) as etag,
   t.token_symbol as token_symbol,
-  toFloat64(t.price) as price,
+  {{ to_float_or_null('t.price') }} as price,
   cast(t.date_time as DateTime('UTC')) as date_time
 FROM {{ source('dlt', 'beefy_api___prices') }} t
 
@@ -1,17 +1,18 @@
 from __future__ import annotations
 import dlt
-from sources.beefy_api import beefy_api_source
+from sources.beefy_api import pipeline_profile, beefy_api_source
 from lib.config import configure_env
 from lib.cli import run_pipeline_loop
+from lib.clickhouse import get_pipeline_destination
 
 async def main():
+    pipeline_profile().apply('beefy_api')
     pipeline = dlt.pipeline(
         pipeline_name='beefy_api',
         dev_mode=False,
-        staging="filesystem",
         progress="log",
         dataset_name='beefy_api',
-        destination='clickhouse',
+        **get_pipeline_destination('beefy_api', 'beefy_api'),
     )
 
     source = await beefy_api_source()
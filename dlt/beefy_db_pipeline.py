@@ -1,17 +1,18 @@
 from __future__ import annotations
 import dlt
-from sources.beefy_db import beefy_db_source
+from sources.beefy_db import pipeline_profile, beefy_db_source
 from lib.config import configure_env
 from lib.cli import run_pipeline_loop
+from lib.clickhouse import get_pipeline_destination
 
 async def main():
+    pipeline_profile().apply('beefy_db')
     pipeline = dlt.pipeline(
         pipeline_name='beefy_db',
         dev_mode=False,
-        staging="filesystem",
         progress="log",
         dataset_name='beefy_db',
-        destination='clickhouse',
+        **get_pipeline_destination('beefy_db', 'beefy_db'),
     )
 
     source = await beefy_db_source()
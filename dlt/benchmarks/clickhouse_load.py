@@ -0,0 +1,59 @@
+"""
+End-to-end latency of the ClickHouse load modes on a beefy_api-like snapshot.
+
+Runs the same arrow snapshot through a pipeline in "staging" mode (filesystem staging,
+ClickHouse reads the files back) and in "direct" mode (insert_arrow from the loader),
+each in its own benchmark dataset.
+
+Usage (from the dlt directory, with the usual ClickHouse / MinIO environment):
+    uv run python -m benchmarks.clickhouse_load [rows]
+"""
+import sys
+import time
+from datetime import datetime, timezone
+import dlt
+import pyarrow as pa
+from lib.clickhouse import clickhouse_arrow_destination
+from lib.config import configure_env
+
+DEFAULT_ROWS = 20_000
+REPEAT = 5
+
+
+def make_snapshot(num_rows: int) -> pa.Table:
+    now = datetime.now(timezone.utc)
+    return pa.table({
+        "etag": pa.array([now.isoformat()] * num_rows, type=pa.string()),
+        "vault_id": pa.array([f"vault-{i}" for i in range(num_rows)], type=pa.string()),
+        "apy": pa.array([i / num_rows for i in range(num_rows)], type=pa.float64()),
+        "date_time": pa.array([now] * num_rows, type=pa.timestamp("us", tz="UTC")),
+    })
+
+
+def run(pipeline: dlt.Pipeline, num_rows: int) -> float:
+    @dlt.resource(name="apy", primary_key=["etag", "vault_id"], write_disposition={"disposition": "merge", "strategy": "delete-insert"})
+    def apy():
+        yield make_snapshot(num_rows)
+
+    started_at = time.perf_counter()
+    pipeline.run(apy())
+    return time.perf_counter() - started_at
+
+
+def main() -> None:
+    configure_env()
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROWS
+
+    staging = dlt.pipeline(pipeline_name="bench_load_staging", dataset_name="bench_load", destination="clickhouse", staging="filesystem")
+    # the direct mode does not create tables, the first staging run does
+    run(staging, num_rows)
+    direct = dlt.pipeline(pipeline_name="bench_load_direct", dataset_name="bench_load", destination=clickhouse_arrow_destination("bench_load"))
+
+    print(f"apy snapshot, {num_rows} rows, best of {REPEAT}")
+    for mode, pipeline in [("staging", staging), ("direct", direct)]:
+        timings = [run(pipeline, num_rows) for _ in range(REPEAT)]
+        print(f"  {mode:>8}: {min(timings) * 1000:8.1f} ms (median {sorted(timings)[REPEAT // 2] * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Micro-benchmark of the JSON decode backends on recorded Beefy API payloads.
+
+Usage (from the dlt directory):
+    uv run python -m benchmarks.json_decode [--record]
+
+Fixtures are recorded from the live API into benchmarks/fixtures on first run
+(or when --record is passed) and are not committed.
+"""
+import sys
+import timeit
+from pathlib import Path
+import httpx
+from lib.fastjson import _BACKENDS
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+FIXTURES = {
+    "apy_breakdown.json": "https://api.beefy.finance/apy/breakdown",
+    "vaults.json": "https://api.beefy.finance/vaults",
+}
+REPEAT = 5
+
+
+def record_fixtures(force: bool = False) -> None:
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    for file_name, url in FIXTURES.items():
+        path = FIXTURES_DIR / file_name
+        if path.exists() and not force:
+            continue
+        print(f"recording {url} -> {path}")
+        response = httpx.get(url, timeout=30.0)
+        response.raise_for_status()
+        path.write_bytes(response.content)
+
+
+def main() -> None:
+    record_fixtures(force="--record" in sys.argv)
+
+    for file_name in FIXTURES:
+        data = (FIXTURES_DIR / file_name).read_bytes()
+        print(f"{file_name} ({len(data) / 1024 / 1024:.1f} MiB)")
+        for backend, get_loads in _BACKENDS.items():
+            try:
+                loads = get_loads()
+            except ImportError:
+                print(f"  {backend:>8}: not installed")
+                continue
+            best = min(timeit.repeat(lambda: loads(data), number=1, repeat=REPEAT))
+            print(f"  {backend:>8}: {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,18 @@
 from __future__ import annotations
 import dlt
-from sources.github_files import github_files_source
+from sources.github_files import pipeline_profile, github_files_source
 from lib.config import configure_env
 from lib.cli import run_pipeline_loop
+from lib.clickhouse import get_pipeline_destination
 
 async def main():
+    pipeline_profile().apply('github_files')
     pipeline = dlt.pipeline(
         pipeline_name='github_files',
         dev_mode=False,
-        staging="filesystem",
         progress="log",
         dataset_name='github_files',
-        destination='clickhouse',
+        **get_pipeline_destination('github_files', 'github_files'),
     )
 
     source = await github_files_source()
@@ -0,0 +1,197 @@
+import functools
+import hashlib
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, MutableMapping, Optional, Sequence
+import dlt
+import pyarrow as pa
+import pyarrow.compute as pc
+from lib.config import TRACK_ROW_CHANGES
+
+logger = logging.getLogger(__name__)
+
+# hard delete flag of the rows removed from the source, see `DELETED_COLUMN_HINT`
+DELETED_COLUMN = "_deleted"
+# merge tables with this column hint delete the rows flagged by `DELETED_COLUMN` on load
+DELETED_COLUMN_HINT = {"name": DELETED_COLUMN, "data_type": "bool", "nullable": True, "hard_delete": True}
+# column hints to add to the resources tracking row changes
+DELETED_COLUMNS = {DELETED_COLUMN: DELETED_COLUMN_HINT} if TRACK_ROW_CHANGES else {}
+
+
+# separators of the column values in the row encodings of arrow tables, and of the key and
+# fingerprint in the state entries they are compared with
+_COLUMN_SEPARATOR = "\x1f"
+_ENTRY_SEPARATOR = "\x1e"
+_NULL = "\x00"
+
+
+def _digest(encoded: bytes) -> str:
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def _fingerprint(row: Dict[str, Any]) -> str:
+    return _digest(json.dumps(row, sort_keys=True, default=str, separators=(",", ":")).encode())
+
+
+def _column_strings(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    A column cast to strings, nested types (which have no string cast) are JSON encoded.
+
+    Backslashes and the separator characters are escaped, so a value can not be mistaken for
+    a null or spill into the next column once the row is joined.
+    """
+    try:
+        strings = pc.cast(column, pa.string())
+    except pa.ArrowNotImplementedError:
+        strings = pa.chunked_array([pa.array([json.dumps(value, sort_keys=True, default=str) for value in column.to_pylist()], pa.string())])
+    for character, escaped in (("\\", "\\\\"), (_COLUMN_SEPARATOR, "\\x1f"), (_NULL, "\\x00")):
+        strings = pc.replace_substring(strings, character, escaped)
+    return strings
+
+
+def _encode_rows(table: pa.Table, columns: Sequence[str]) -> pa.ChunkedArray:
+    """One string per row joining the values of `columns`, computed column-wise."""
+    strings = [_column_strings(table.column(column)) for column in columns]
+    return pc.binary_join_element_wise(*strings, _COLUMN_SEPARATOR, null_handling="replace", null_replacement=_NULL)
+
+
+class RowChanges:
+    """
+    Row level change detection for full refresh resources.
+
+    Every row is fingerprinted on extract and compared with the fingerprints of the previous
+    run, kept in the resource state (so they are only persisted along with a successful load).
+    The state holds one entry per row, which is why TRACK_ROW_CHANGES is opt-in: only enable
+    it for tables small enough for their key to fingerprint map to live in the dlt state.
+    Arrow tables keep the typed primary key values next to each fingerprint, the tombstones
+    are built from them rather than from the encoded key.
+    Only the inserted and updated rows are passed on, followed by a tombstone row flagged with
+    `DELETED_COLUMN` for every primary key that disappeared from the source.
+    """
+
+    def __init__(self, state: MutableMapping[str, Any], primary_key: Sequence[str], state_key: str = "row_fingerprints") -> None:
+        self.state = state
+        self.state_key = state_key
+        self.primary_key = list(primary_key)
+        # key -> fingerprint for items, key -> [fingerprint, primary key values] for arrow tables
+        self.previous: Dict[str, Any] = state.get(state_key, {})
+        self.current: Dict[str, Any] = {}
+        self.changed = 0
+        self._arrow_schema: Optional[pa.Schema] = None
+        self._previous_entries: Optional[pa.Array] = None
+
+    def _key(self, row: Dict[str, Any]) -> str:
+        return json.dumps([row[column] for column in self.primary_key], default=str)
+
+    def is_changed(self, row: Dict[str, Any]) -> bool:
+        key = self._key(row)
+        fingerprint = _fingerprint(row)
+        self.current[key] = fingerprint
+        if self.previous.get(key) == fingerprint:
+            return False
+        self.changed += 1
+        return True
+
+    def filter_table(self, table: pa.Table) -> pa.Table:
+        """
+        Keep the changed rows of an arrow table.
+
+        Keys and row encodings are computed column-wise with pyarrow.compute, only the final
+        digest of each encoded row runs in Python, and rows are compared with the previous
+        run as `key, fingerprint` entries in a single `is_in` lookup. The primary key values
+        are only read as Python objects for the keys the previous run did not have.
+        """
+        if self._arrow_schema is None:
+            self._arrow_schema = table.schema
+            self._previous_entries = pa.array([f"{key}{_ENTRY_SEPARATOR}{fingerprint}" for key, (fingerprint, _) in self.previous.items()], pa.string())
+        keys = _encode_rows(table, self.primary_key)
+        fingerprints = pa.array([_digest(row) for row in _encode_rows(table, table.column_names).cast(pa.binary()).to_pylist()], pa.string())
+
+        new_keys = pc.invert(pc.is_in(keys, value_set=pa.array(list(self.previous.keys()), pa.string())))
+        new_values = iter(zip(*(table.column(column).filter(new_keys).to_pylist() for column in self.primary_key)))
+        for key, fingerprint, is_new in zip(keys.to_pylist(), fingerprints.to_pylist(), new_keys.to_pylist()):
+            values = list(next(new_values)) if is_new else self.previous[key][1]
+            self.current[key] = [fingerprint, values]
+
+        entries = pc.binary_join_element_wise(keys, fingerprints, _ENTRY_SEPARATOR)
+        mask = pc.invert(pc.is_in(entries, value_set=self._previous_entries))
+        changed = table.filter(mask)
+        self.changed += changed.num_rows
+        return changed
+
+    def deleted_rows(self) -> List[Dict[str, Any]]:
+        deleted = []
+        for key in self.previous.keys() - self.current.keys():
+            row = dict(zip(self.primary_key, json.loads(key)))
+            row[DELETED_COLUMN] = True
+            deleted.append(row)
+        return deleted
+
+    def deleted_table(self) -> Optional[pa.Table]:
+        """
+        Tombstones of the primary keys missing from the filtered arrow tables, typed like the
+        tables, or inferred from the stored values when the source had no rows at all.
+        """
+        deleted = [values for key, (_, values) in self.previous.items() if key not in self.current]
+        if not deleted:
+            return None
+        columns = [[values[i] for values in deleted] for i in range(len(self.primary_key))]
+        if self._arrow_schema is not None:
+            fields = [self._arrow_schema.field(column) for column in self.primary_key]
+            arrays = [pa.array(values, field.type) for values, field in zip(columns, fields)]
+        else:
+            arrays = [pa.array(values) for values in columns]
+            fields = [pa.field(column, array.type) for column, array in zip(self.primary_key, arrays)]
+        fields.append(pa.field(DELETED_COLUMN, pa.bool_()))
+        return pa.Table.from_arrays(arrays + [pa.array([True] * len(deleted), pa.bool_())], schema=pa.schema(fields))
+
+    def commit(self, name: str) -> None:
+        logger.info(f"{name}: {self.changed} changed, {len(self.previous.keys() - self.current.keys())} deleted, {len(self.current)} rows")
+        self.state[self.state_key] = self.current
+
+
+def track_table_changes(name: str, tables: Iterator[pa.Table], state: MutableMapping[str, Any], primary_key: Sequence[str]) -> Iterator[pa.Table]:
+    """Only yield the changed rows of arrow `tables`, then tombstones for the deleted ones."""
+    # arrow tables are keyed by their column-wise encoding, not the JSON keys of the items,
+    # and keep their primary key values (which earlier versions of the state did not)
+    state.pop("row_fingerprints", None)
+    state.pop("table_row_fingerprints", None)
+    changes = RowChanges(state, primary_key, state_key="table_rows")
+    for table in tables:
+        changed = changes.filter_table(table)
+        if changed.num_rows:
+            yield changed
+
+    deleted = changes.deleted_table()
+    if deleted is not None:
+        yield deleted
+    changes.commit(name)
+
+
+async def track_item_changes(name: str, items: AsyncIterator[Dict[str, Any]], state: MutableMapping[str, Any], primary_key: Sequence[str]) -> AsyncIterator[Dict[str, Any]]:
+    """Only yield the changed `items`, then tombstones for the deleted ones."""
+    changes = RowChanges(state, primary_key)
+    async for item in items:
+        if changes.is_changed(item):
+            yield item
+
+    for row in changes.deleted_rows():
+        yield row
+    changes.commit(name)
+
+
+def track_row_changes(name: str, primary_key: Sequence[str]) -> Callable[[Callable[..., AsyncIterator[Dict[str, Any]]]], Callable[..., AsyncIterator[Dict[str, Any]]]]:
+    """Decorate an async resource function `name` to only yield its changed items, when TRACK_ROW_CHANGES is on."""
+
+    def decorator(func: Callable[..., AsyncIterator[Dict[str, Any]]]) -> Callable[..., AsyncIterator[Dict[str, Any]]]:
+        if not TRACK_ROW_CHANGES:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+            async for item in track_item_changes(name, func(*args, **kwargs), dlt.current.resource_state(name), primary_key):
+                yield item
+
+        return wrapper
+
+    return decorator
@@ -1,11 +1,19 @@
 from __future__ import annotations
 from dataclasses import dataclass
 import sys
+import time
 from typing import Optional
 
 import logging
+import psutil
+from lib.config import PARQUET_COMPRESSION, STAGING_FILE_FORMAT
+from lib.fetch import close_http_clients, reset_stats
+from lib.metrics import bytes_per_table, push_metrics, record_run, start_run
 logger = logging.getLogger(__name__)
 
+# start of the current run in a long-lived process, see `mark_run_start`
+_run_started_at: Optional[float] = None
+
 @dataclass
 class CliArgs:
     show_list: bool = False
@@ -60,15 +68,60 @@ def _should_loop(source: Any, args: CliArgs, previous_load_info: Any) -> bool:
 
 
 
+def _log_load_bytes(load_info: Any) -> None:
+    """Log the size of the files loaded per table: written to the staging, then read back by ClickHouse."""
+    sizes = bytes_per_table(load_info)
+    if sizes:
+        logger.info(
+            "%s loaded %d bytes (%s, %s): %s",
+            load_info.pipeline.pipeline_name,
+            sum(sizes.values()),
+            STAGING_FILE_FORMAT,
+            PARQUET_COMPRESSION,
+            ", ".join(f"{table_name}={size}" for table_name, size in sorted(sizes.items(), key=lambda item: -item[1])),
+        )
+
+
+def mark_run_start() -> None:
+    """Mark the start of a run in a long-lived process (warm scheduler worker), so the startup time excludes its warm-up."""
+    global _run_started_at
+    _run_started_at = time.time()
+    reset_stats()
+
+
+def _startup_seconds() -> float:
+    """Time from the start of the run to the first `pipeline.run`: interpreter, imports and source construction."""
+    if _run_started_at is not None:
+        return time.time() - _run_started_at
+    process = psutil.Process()
+    started_at = process.create_time()
+    # include the environment resolution of `uv run`
+    parent = process.parent()
+    if parent is not None and parent.name() == "uv":
+        started_at = parent.create_time()
+    return time.time() - started_at
+
+
 async def run_pipeline_loop(pipeline: dlt.Pipeline, source_config: Any) -> Any:
     args = _parse_args()
-
-    
-    while True:
-        source = _apply_args_to_source(source_config, args)
-        load_info = pipeline.run(source)
-        print(load_info)
-        if not _should_loop(source, args, load_info):
-            break
+    logger.info("%s startup: %.2fs", pipeline.pipeline_name, _startup_seconds())
+    # the direct load mode has its own file format
+    loader_file_format = STAGING_FILE_FORMAT if pipeline.destination.destination_name == "clickhouse" else None
+
+    start_run(pipeline.pipeline_name)
+    success = False
+    try:
+        while True:
+            source = _apply_args_to_source(source_config, args)
+            load_info = pipeline.run(source, loader_file_format=loader_file_format)
+            print(load_info)
+            _log_load_bytes(load_info)
+            record_run(pipeline, load_info)
+            if not _should_loop(source, args, load_info):
+                break
+        success = True
+    finally:
+        await close_http_clients()
+        push_metrics(pipeline.pipeline_name, success)
 
     return load_info
\ No newline at end of file
@@ -1,26 +1,55 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Iterable
 import dlt
 import clickhouse_connect
-from lib.config import get_clickhouse_credentials
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dlt.common.pipeline import get_dlt_pipelines_dir
+from dlt.common.schema.typing import TTableSchema
+from dlt.common.utils import uniq_id
+from lib.changes import DELETED_COLUMN
+from lib.config import BATCH_SIZE, get_clickhouse_credentials, get_pipeline_load_mode, is_production
+
+logger = logging.getLogger(__name__)
 
 # Cache for the ClickHouse async client
 _client_cache: clickhouse_connect.driver.asyncclient.AsyncClient | None = None
+# the client wraps a sync client in a thread pool so it can be shared across event loops and
+# threads (dlt load jobs run their own loops in worker threads), so its creation is guarded
+# by a thread lock, taken from a worker thread to never block an event loop
+_client_lock = threading.Lock()
+
+
+def _create_clickhouse_client() -> clickhouse_connect.driver.asyncclient.AsyncClient:
+    global _client_cache
+
+    with _client_lock:
+        if _client_cache is None:
+            credentials = get_clickhouse_credentials()
+            client = clickhouse_connect.get_client(
+                host=credentials["host"],
+                port=8123, # must use http port for http client
+                user=credentials["user"],
+                password=credentials["password"],
+                database=credentials["database"],
+                secure=credentials["secure"],
+                # no session, so the client can run concurrent queries
+                autogenerate_session_id=False,
+            )
+            _client_cache = clickhouse_connect.driver.asyncclient.AsyncClient(client=client)
+        return _client_cache
+
 
 async def get_clickhouse_client() -> clickhouse_connect.driver.asyncclient.AsyncClient:
     """Create and return a cached ClickHouse async client from dlt credentials."""
-    global _client_cache
-    
-    if _client_cache is None:
-        credentials = get_clickhouse_credentials()
-        _client_cache = await clickhouse_connect.get_async_client(
-            host=credentials["host"],
-            port=8123, # must use http port for http client
-            user=credentials["user"],
-            password=credentials["password"],
-            database=credentials["database"],
-            secure=credentials["secure"],
-        )
-    
-    return _client_cache
+    if _client_cache is not None:
+        return _client_cache
+    return await asyncio.to_thread(_create_clickhouse_client)
 
 
 def clickhouse_default_database() -> str:
@@ -54,3 +83,142 @@ async def clickhouse_table_exists(table_name: str, database: str | None = None)
     result = await client.query(query, parameters={"database": db, "table": tbl})
     count = result.result_rows[0][0] if result.result_rows else 0
     return count > 0
+
+
+async def apply_table_ddl(resource_name: str, table_name: str, sql: str) -> str:
+    """
+    Run the `CREATE TABLE` statement of a resource, unless this exact version of it was already
+    applied and its table still exists.
+
+    Applied versions are read from the resource state, where the resource is expected to store
+    the returned version once it runs, so they are only remembered after a successful load.
+    The state can outlive the table (dropped, or database recreated), which dlt would then
+    create itself with its default engine and sorting key: the statement runs again whenever
+    `table_name` is missing.
+    Must be called from a dlt source function.
+
+    Returns:
+        The DDL version (a hash of the statement).
+    """
+    version = hashlib.sha256(sql.encode()).hexdigest()[:16]
+    applied = dlt.current.source_state().get("resources", {}).get(resource_name, {}).get("ddl_version")
+    if applied == version and await clickhouse_table_exists(table_name):
+        logger.info("%s table DDL %s already applied, skipping", resource_name, version)
+        return version
+
+    client = await get_clickhouse_client()
+    await client.query(sql)
+    return version
+
+
+## ========================================================
+## Direct load mode: arrow batches inserted by the loader
+## ========================================================
+
+async def _get_table_columns(table: str) -> list[str]:
+    client = await get_clickhouse_client()
+    result = await client.query(
+        "SELECT name FROM system.columns WHERE database = currentDatabase() AND table = %(table)s ORDER BY position",
+        parameters={"table": table},
+    )
+    return [row[0] for row in result.result_rows]
+
+
+async def insert_arrow_batches(table: str, batches: Iterable[pa.RecordBatch], primary_key: list[str], write_disposition: str, load_id: str) -> None:
+    """
+    Insert arrow batches in an existing ClickHouse table with the native Arrow format.
+
+    Append batches are inserted as is (the custom ReplacingMergeTree tables deduplicate on their
+    sorting key). Merge batches are all inserted in a scratch copy of the table, then rows with
+    the same primary key are deleted with a single DELETE mutation and the scratch rows (minus
+    the hard deleted ones) are inserted.
+    """
+    columns = await _get_table_columns(table)
+    if not columns:
+        raise ValueError(f"ClickHouse table {table} does not exist, create it (or run the pipeline once in staging mode) before loading it directly")
+
+    def with_dlt_columns(batch: pa.RecordBatch) -> pa.Table:
+        arrow_table = pa.Table.from_batches([batch])
+        if "_dlt_load_id" in columns and "_dlt_load_id" not in arrow_table.column_names:
+            arrow_table = arrow_table.append_column("_dlt_load_id", pa.array([load_id] * arrow_table.num_rows, type=pa.string()))
+        if "_dlt_id" in columns and "_dlt_id" not in arrow_table.column_names:
+            arrow_table = arrow_table.append_column("_dlt_id", pa.array([uniq_id() for _ in range(arrow_table.num_rows)], type=pa.string()))
+        return arrow_table
+
+    client = await get_clickhouse_client()
+    if write_disposition != "merge" or not primary_key:
+        for batch in batches:
+            await client.insert_arrow(table, with_dlt_columns(batch))
+        return
+
+    scratch_table = f"{table}__direct_{uniq_id(8).lower()}"
+    keys = ", ".join(f"`{column}`" for column in primary_key)
+    not_deleted = f" WHERE NOT ifNull(`{DELETED_COLUMN}`, false)" if DELETED_COLUMN in columns else ""
+    await client.command(f"CREATE TABLE `{scratch_table}` AS `{table}`")
+    try:
+        for batch in batches:
+            await client.insert_arrow(scratch_table, with_dlt_columns(batch))
+        await client.command(f"DELETE FROM `{table}` WHERE ({keys}) IN (SELECT {keys} FROM `{scratch_table}`)")
+        await client.command(f"INSERT INTO `{table}` SELECT * FROM `{scratch_table}`{not_deleted}")
+    finally:
+        await client.command(f"DROP TABLE IF EXISTS `{scratch_table}`")
+
+
+def clickhouse_arrow_destination(dataset_name: str) -> Any:
+    """
+    dlt destination inserting the load packages straight into the ClickHouse tables of `dataset_name`.
+
+    Skips the filesystem staging round trip (write files, upload, ClickHouse reads them back):
+    normalized parquet files are streamed as arrow record batches and inserted with `insert_arrow`.
+    The destination gets one call per load file (batch_size=0), so a merge table costs a single
+    DELETE mutation per file rather than one per batch.
+    This destination does not create or migrate tables, and the pipeline state is only kept locally.
+    """
+
+    @dlt.destination(
+        name="clickhouse_arrow",
+        loader_file_format="parquet",
+        batch_size=0,
+        naming_convention="snake_case",
+    )
+    def clickhouse_arrow(items: str, table: TTableSchema) -> None:
+        primary_key = [name for name, column in table["columns"].items() if column.get("primary_key")]
+        asyncio.run(insert_arrow_batches(
+            f"{dataset_name}___{table['name']}",
+            pq.ParquetFile(items).iter_batches(batch_size=BATCH_SIZE),
+            primary_key,
+            table.get("write_disposition", "append"),
+            dlt.current.load_package_state()["load_id"],
+        ))
+
+    return clickhouse_arrow
+
+
+def _is_persistent_dir(path: str) -> bool:
+    """Best effort check that `path` survives a restart: not a temp dir, nor the root filesystem of a container."""
+    path = os.path.realpath(path)
+    temp_dir = os.path.realpath(tempfile.gettempdir())
+    if os.path.commonpath([path, temp_dir]) == temp_dir:
+        return False
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path != "/" or not os.path.exists("/.dockerenv")
+
+
+def get_pipeline_destination(pipeline_name: str, dataset_name: str) -> dict[str, Any]:
+    """
+    dlt.pipeline destination arguments for the load mode selected for `pipeline_name`.
+
+    The direct mode only keeps the pipeline state in the local working dir: it is refused in
+    production (and warned about otherwise) when that dir does not look persistent, as losing
+    it means losing the incremental cursors.
+    """
+    if get_pipeline_load_mode(pipeline_name) == "direct":
+        pipelines_dir = get_dlt_pipelines_dir()
+        if not _is_persistent_dir(pipelines_dir):
+            message = f"{pipeline_name} direct load mode keeps its state in {pipelines_dir}, which is not on a persistent volume"
+            if is_production():
+                raise ValueError(message)
+            logger.warning(message)
+        return {"destination": clickhouse_arrow_destination(dataset_name)}
+    return {"destination": "clickhouse", "staging": "filesystem"}
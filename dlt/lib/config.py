@@ -1,6 +1,7 @@
 import os
 import dlt
 import logging
+from lib.parquet import configure_parquet_compression
 
 
 ## ========================================================
@@ -12,6 +13,55 @@ def is_production() -> bool:
 
 BATCH_SIZE = 1_000_000
 
+# JSON decoder used for the HTTP sources: msgspec, orjson or json (stdlib)
+JSON_BACKEND = os.environ.get("DLT_JSON_BACKEND", "msgspec")
+
+# Parallel backfill of the beefy_db incremental tables, used when the cursor is more than
+# one window behind. Max concurrent Postgres queries per table (1 disables it, the resource
+# profiles use at most one per CPU) and max windows per run.
+BEEFY_DB_BACKFILL_WORKERS = int(os.environ.get("BEEFY_DB_BACKFILL_WORKERS", "4"))
+BEEFY_DB_BACKFILL_MAX_WINDOWS = int(os.environ.get("BEEFY_DB_BACKFILL_MAX_WINDOWS", "16"))
+
+# Rows per extraction window the beefy_db incremental tables aim for, window sizes are
+# adapted to the row density observed on the previous windows (see lib/postgres.py)
+BEEFY_DB_WINDOW_TARGET_ROWS = int(os.environ.get("BEEFY_DB_WINDOW_TARGET_ROWS", str(BATCH_SIZE // 2)))
+
+# The ID lists used to filter the beefy_db incremental tables are cached for this long (in seconds).
+# With BEEFY_DB_ID_FILTER=subquery, tables are filtered with an IN (SELECT ...) semi-join in
+# Postgres instead of binding the ID lists as arrays.
+BEEFY_DB_ID_CACHE_TTL = int(os.environ.get("BEEFY_DB_ID_CACHE_TTL", "900"))
+BEEFY_DB_ID_FILTER = os.environ.get("BEEFY_DB_ID_FILTER", "array")
+
+# Max rows fetched per round trip from the beefy_db server-side cursors of the full reload tables
+BEEFY_DB_STREAM_CHUNK_SIZE = int(os.environ.get("BEEFY_DB_STREAM_CHUNK_SIZE", "50000"))
+# Skip the full reload tables whose Postgres write counters did not move since the last load.
+# Only valid against the primary, see lib.postgres._table_write_signature
+BEEFY_DB_SKIP_UNCHANGED_TABLES = os.environ.get("BEEFY_DB_SKIP_UNCHANGED_TABLES", "false").lower() == "true"
+
+# Only load the inserted/updated/deleted rows of the full refresh resources, see lib/changes.py.
+# Opt-in: one fingerprint per row is kept in the dlt state of the resources.
+TRACK_ROW_CHANGES = os.environ.get("DLT_TRACK_ROW_CHANGES", "false").lower() == "true"
+
+def get_pipeline_load_mode(pipeline_name: str) -> str:
+    """
+    Load mode of a pipeline, from <PIPELINE_NAME>_LOAD_MODE (e.g. BEEFY_API_LOAD_MODE):
+    "staging" (default) loads through the filesystem staging, "direct" inserts arrow batches
+    straight into ClickHouse (see lib/clickhouse.py).
+    """
+    return os.environ.get(f"{pipeline_name.upper()}_LOAD_MODE", "staging")
+
+# Staging files: format (parquet or jsonl), parquet codec (zstd, lz4, snappy, gzip or none),
+# optional codec level and rows per parquet row group
+STAGING_FILE_FORMAT = os.environ.get("DLT_STAGING_FILE_FORMAT", "parquet")
+PARQUET_COMPRESSION = os.environ.get("DLT_PARQUET_COMPRESSION", "zstd")
+PARQUET_COMPRESSION_LEVEL = int(os.environ["DLT_PARQUET_COMPRESSION_LEVEL"]) if os.environ.get("DLT_PARQUET_COMPRESSION_LEVEL") else None
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get("DLT_PARQUET_ROW_GROUP_SIZE", "100000"))
+
+# Run metrics (see lib/metrics.py) are pushed to this Prometheus pushgateway (host:port)
+# and/or written as <pipeline>.prom files in this directory, for a textfile collector
+METRICS_PUSHGATEWAY = os.environ.get("DLT_METRICS_PUSHGATEWAY")
+METRICS_TEXTFILE_DIR = os.environ.get("DLT_METRICS_TEXTFILE_DIR")
+
 # Pipeline iteration timeout (in seconds)
 PIPELINE_ITERATION_TIMEOUT = int(os.environ.get("DLT_PIPELINE_ITERATION_TIMEOUT", "3600"))
 
@@ -32,18 +82,16 @@ def configure_dlt() -> None:
     dlt.config["truncate_staging_dataset"] = True
     os.environ['LOAD__TRUNCATE_STAGING_DATASET'] = 'true'
 
-    os.environ['EXTRACT__WORKERS'] = "3"
+    # workers and writer buffers are sized per pipeline, see the performance profiles in lib/profiles.py
     os.environ['EXTRACT__DATA_WRITER__DISABLE_COMPRESSION'] = 'true'
-    os.environ['EXTRACT__DATA_WRITER__BUFFER_MAX_ITEMS'] = str(BATCH_SIZE)
-    os.environ['EXTRACT__DATA_WRITER__FILE_MAX_ITEMS'] = str(BATCH_SIZE)
-    os.environ['NORMALIZE__WORKERS'] = '3'
     os.environ['NORMALIZE__DATA_WRITER__DISABLE_COMPRESSION'] = 'true'
-    os.environ['NORMALIZE__DATA_WRITER__BUFFER_MAX_ITEMS'] = str(BATCH_SIZE)
-    os.environ['NORMALIZE__DATA_WRITER__FILE_MAX_ITEMS'] = str(BATCH_SIZE)
-    os.environ["LOAD__WORKERS"] = "3"
     os.environ['LOAD__DATA_WRITER__DISABLE_COMPRESSION'] = 'true'
-    os.environ['LOAD__DATA_WRITER__BUFFER_MAX_ITEMS'] = str(BATCH_SIZE)
-    os.environ['LOAD__DATA_WRITER__FILE_MAX_ITEMS'] = str(BATCH_SIZE)
+
+    # parquet staging files, compressed by the parquet writers themselves
+    configure_parquet_compression(PARQUET_COMPRESSION, PARQUET_COMPRESSION_LEVEL)
+    os.environ['NORMALIZE__START_METHOD'] = 'fork'
+    os.environ['EXTRACT__DATA_WRITER__ROW_GROUP_SIZE'] = str(PARQUET_ROW_GROUP_SIZE)
+    os.environ['NORMALIZE__DATA_WRITER__ROW_GROUP_SIZE'] = str(PARQUET_ROW_GROUP_SIZE)
 
     logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
     logging.basicConfig(level=logging.INFO)
@@ -5,4 +5,14 @@ def get_int_like(obj: Any, key: str) -> Optional[int]:
     if val == "NaN":
         return None
 
-    return val
\ No newline at end of file
+    return val
+
+
+def to_float(val: Any) -> Optional[float]:
+    """Convert API numbers (which may come as strings or be missing) to float, None if not a number."""
+    if val is None:
+        return None
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
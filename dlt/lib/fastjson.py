@@ -0,0 +1,56 @@
+import json
+import logging
+from typing import Any, Callable, Dict
+from lib.config import JSON_BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+def _msgspec_loads() -> Callable[[bytes], Any]:
+    import msgspec
+    return msgspec.json.Decoder().decode
+
+
+def _orjson_loads() -> Callable[[bytes], Any]:
+    # NOTE: orjson decodes integers larger than 64 bits as floats (precision loss on raw token amounts)
+    import orjson
+    return orjson.loads
+
+
+def _stdlib_loads() -> Callable[[bytes], Any]:
+    return json.loads
+
+
+_BACKENDS: Dict[str, Callable[[], Callable[[bytes], Any]]] = {
+    "msgspec": _msgspec_loads,
+    "orjson": _orjson_loads,
+    "json": _stdlib_loads,
+}
+
+
+def _get_loads(backend: str) -> Callable[[bytes], Any]:
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown JSON backend {backend}, expected one of {list(_BACKENDS.keys())}")
+    try:
+        return _BACKENDS[backend]()
+    except ImportError:
+        logger.warning("JSON backend %s is not installed, falling back to the stdlib json module", backend)
+        return json.loads
+
+
+_loads = _get_loads(JSON_BACKEND)
+
+
+def loads(data: bytes) -> Any:
+    """
+    Decode a JSON document with the configured fast backend.
+
+    The fast decoders are strict about the JSON spec, payloads they reject
+    (NaN / Infinity literals, out of range floats) are decoded again with the stdlib.
+    """
+    try:
+        return _loads(data)
+    except ValueError:
+        if _loads is json.loads:
+            raise
+        return json.loads(data)
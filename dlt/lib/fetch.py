@@ -1,23 +1,158 @@
-from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, MutableMapping, Optional, Tuple
 import httpx
+import ijson
+from lib import fastjson
+from lib.metrics import HTTP_FETCH
 
+logger = logging.getLogger(__name__)
 
-async def fetch_url_text(url: str) -> str:
-    limits = httpx.Limits(max_keepalive_connections=100, max_connections=200)
-    async with httpx.AsyncClient(limits=limits, timeout=5.0) as client:
-        response = await client.get(url)
+HTTP_TIMEOUT = 5.0
+HTTP_MAX_CONNECTIONS = 200
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 100
+HTTP_KEEPALIVE_EXPIRY = 60.0
+# all our fetches hit a handful of hosts (api.beefy.finance, raw.githubusercontent.com),
+# cap in-flight requests per host so parallelized resources don't hammer a single server
+HTTP_MAX_CONNECTIONS_PER_HOST = 20
+
+# dlt runs async resources on its own event loop (one per extract step), while the source
+# functions run on the main loop. httpx clients are bound to the loop they are used on,
+# so we keep one pooled client per loop and share it between all resources of that loop.
+_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+_host_semaphores: Dict[Tuple[asyncio.AbstractEventLoop, str], asyncio.Semaphore] = {}
+
+# connection reuse and conditional GET counters, logged when the clients are closed
+_stats = {"requests": 0, "new_connections": 0, "not_modified": 0}
+
+
+def reset_stats() -> None:
+    """Reset the connection counters, for runs sharing a long-lived process."""
+    for key in _stats:
+        _stats[key] = 0
+
+
+async def _trace(event_name: str, info: Dict[str, Any]) -> None:
+    """httpcore trace hook, called for every connection level event."""
+    if event_name == "connection.connect_tcp.complete":
+        _stats["new_connections"] += 1
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get or create the pooled HTTP client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                max_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=HTTP_TIMEOUT,
+        )
+        _clients[loop] = client
+    return client
+
+
+def _get_host_semaphore(url: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    key = (loop, httpx.URL(url).host)
+    semaphore = _host_semaphores.get(key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        _host_semaphores[key] = semaphore
+    return semaphore
+
+
+async def _get(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    client = get_http_client()
+    async with _get_host_semaphore(url):
+        _stats["requests"] += 1
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            response = await client.get(url, headers=headers, extensions={"trace": _trace})
+            status = str(response.status_code)
+        finally:
+            HTTP_FETCH.observe(time.perf_counter() - started_at, host=httpx.URL(url).host, status=status)
+    _raise_for_status(response)
+    return response
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    """raise_for_status, except for 304 Not Modified answers to conditional requests (httpx raises on 3xx)."""
+    if response.status_code != httpx.codes.NOT_MODIFIED:
         response.raise_for_status()
-        return response.text
+
+
+def _conditional_headers(url: str, state: Optional[MutableMapping[str, Any]]) -> Dict[str, str]:
+    """Build If-None-Match / If-Modified-Since headers from the validators stored in `state`."""
+    if state is None:
+        return {}
+    validators = state.setdefault("http_validators", {}).get(url, {})
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def _is_not_modified(url: str, response: httpx.Response, state: Optional[MutableMapping[str, Any]]) -> bool:
+    """Check for a 304 answer, otherwise remember the response validators in `state`."""
+    if response.status_code == httpx.codes.NOT_MODIFIED:
+        _stats["not_modified"] += 1
+        logger.info("%s not modified since last fetch, skipping", url)
+        return True
+
+    if state is not None:
+        state.setdefault("http_validators", {})[url] = {
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
+    return False
+
+
+async def close_http_clients() -> None:
+    """Close every pooled HTTP client, including the ones left behind by dlt extract loops."""
+    current_loop = asyncio.get_running_loop()
+    for loop, client in list(_clients.items()):
+        if loop is current_loop:
+            await client.aclose()
+        elif not loop.is_closed() and not loop.is_running():
+            # dlt stops (but does not close) its extract loop once all resources are exhausted,
+            # run it one last time from a worker thread to shut the connections down gracefully
+            await asyncio.to_thread(loop.run_until_complete, client.aclose())
+        else:
+            logger.warning("Could not close HTTP client bound to a %s event loop", "closed" if loop.is_closed() else "running")
+    _clients.clear()
+    _host_semaphores.clear()
+
+    if _stats["requests"]:
+        logger.info(
+            "HTTP connection pool: %d requests, %d new connections, %d reused",
+            _stats["requests"],
+            _stats["new_connections"],
+            max(_stats["requests"] - _stats["new_connections"], 0),
+        )
+    if _stats["not_modified"]:
+        logger.info("HTTP conditional GET: %d fetches skipped (304 Not Modified)", _stats["not_modified"])
+
+
+async def fetch_url_text(url: str) -> str:
+    response = await _get(url)
+    return response.text
 
 async def _fetch_url_json(url: str) -> Tuple[Any, Optional[str]]:
     """Fetch a URL and return the JSON payload and its ETag, if any."""
-    limits = httpx.Limits(max_keepalive_connections=100, max_connections=200)
-    async with httpx.AsyncClient(limits=limits, timeout=5.0) as client:
-        response = await client.get(url)
-        response.raise_for_status()
-        payload = response.json()
-        etag = response.headers.get("etag")
-        return payload, etag
+    response = await _get(url)
+    payload = fastjson.loads(response.content)
+    etag = response.headers.get("etag")
+    return payload, etag
 
 async def fetch_url_json_list(url: str) -> AsyncIterator[Dict[str, Any]]:
     payload, _ = await _fetch_url_json(url)
@@ -32,4 +167,111 @@ async def fetch_url_json_dict(url: str) -> Tuple[Dict[str, Any], Optional[str]]:
     if not isinstance(payload, dict):
         raise ValueError("Unexpected Beefy API payload; expected a dict.")
     return payload, etag
-    
\ No newline at end of file
+
+
+async def fetch_url_json_dict_if_modified(url: str, state: MutableMapping[str, Any]) -> Optional[Tuple[Dict[str, Any], Optional[str]]]:
+    """
+    Conditional GET of a JSON dict payload.
+
+    The ETag / Last-Modified validators of the previous response are kept in `state`
+    (usually the dlt resource state, so they are only persisted once the load succeeded)
+    and sent back as If-None-Match / If-Modified-Since.
+
+    Returns:
+        The payload and its ETag, or None if the server answered 304 Not Modified.
+    """
+    response = await _get(url, headers=_conditional_headers(url, state))
+    if _is_not_modified(url, response, state):
+        return None
+
+    payload = fastjson.loads(response.content)
+    if not isinstance(payload, dict):
+        raise ValueError("Unexpected Beefy API payload; expected a dict.")
+    return payload, response.headers.get("etag")
+
+
+## ========================================================
+## Streaming mode, for the large payloads
+## ========================================================
+
+class JsonStream:
+    """
+    A JSON response body parsed incrementally as it is downloaded.
+
+    Only the current top-level item is ever materialized, so memory stays flat
+    regardless of the payload size. Implements the async `read` protocol used by ijson.
+    """
+
+    def __init__(self, url: str, response: Optional[httpx.Response]) -> None:
+        self.url = url
+        self.not_modified = response is None
+        self.etag = response.headers.get("etag") if response is not None else None
+        self._chunks = response.aiter_bytes() if response is not None else None
+        self._expected_start: Optional[bytes] = None
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes the stream type with read(0)
+        if size == 0 or self._chunks is None:
+            return b""
+        while True:
+            chunk = await anext(self._chunks, None)
+            if chunk is None:
+                return b""
+            if chunk:
+                break
+
+        if self._expected_start is not None:
+            stripped = chunk.lstrip()
+            if stripped:
+                if stripped[:1] != self._expected_start:
+                    kind = "list" if self._expected_start == b"[" else "dict"
+                    raise ValueError(f"Unexpected Beefy API payload; expected a {kind}.")
+                self._expected_start = None
+        return chunk
+
+    async def items(self) -> AsyncIterator[Any]:
+        """Yield the items of a top-level JSON list."""
+        self._expected_start = b"["
+        async for item in ijson.items(self, "item", use_float=True):
+            yield item
+
+    async def kvitems(self) -> AsyncIterator[Tuple[str, Any]]:
+        """Yield the (key, value) entries of a top-level JSON dict."""
+        self._expected_start = b"{"
+        async for key, value in ijson.kvitems(self, "", use_float=True):
+            yield key, value
+
+
+@asynccontextmanager
+async def stream_url_json(url: str, state: Optional[MutableMapping[str, Any]] = None) -> AsyncIterator[JsonStream]:
+    """
+    Open a streamed JSON response.
+
+    When `state` is given the request is conditional (see `fetch_url_json_dict_if_modified`)
+    and `stream.not_modified` is set on a 304 answer.
+    """
+    client = get_http_client()
+    request = client.build_request("GET", url, headers=_conditional_headers(url, state), extensions={"trace": _trace})
+    async with _get_host_semaphore(url):
+        _stats["requests"] += 1
+        started_at = time.perf_counter()
+        status = "error"
+        try:
+            response = await client.send(request, stream=True)
+            status = str(response.status_code)
+        finally:
+            HTTP_FETCH.observe(time.perf_counter() - started_at, host=request.url.host, status=status)
+        try:
+            _raise_for_status(response)
+            if _is_not_modified(url, response, state):
+                yield JsonStream(url, None)
+            else:
+                yield JsonStream(url, response)
+        finally:
+            await response.aclose()
+
+
+async def stream_url_json_list(url: str) -> AsyncIterator[Dict[str, Any]]:
+    async with stream_url_json(url) as stream:
+        async for item in stream.items():
+            yield item
@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Tuple
+import dlt
+from prometheus_client import CollectorRegistry, Gauge, push_to_gateway, write_to_textfile
+from lib.config import METRICS_PUSHGATEWAY, METRICS_TEXTFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+# pipeline runs are short-lived processes: metrics are pushed at the end of every run
+# instead of being scraped, see `push_metrics`. Every metric has a pipeline label, each
+# pipeline only pushes its own series. They describe the last run: cumulative metrics
+# (counters, histograms) would restart from zero with every process, making rate() meaningless.
+REGISTRY = CollectorRegistry()
+
+LAST_RUN = Gauge("dlt_pipeline_last_run_timestamp_seconds", "Time of the last run", ["pipeline", "status"], registry=REGISTRY)
+STAGE_SECONDS = Gauge("dlt_pipeline_stage_seconds", "Duration of the extract, normalize and load steps of the last run", ["pipeline", "stage"], registry=REGISTRY)
+TABLE_ROWS = Gauge("dlt_table_rows", "Rows extracted per table in the last run", ["pipeline", "table"], registry=REGISTRY)
+TABLE_BYTES = Gauge("dlt_table_staged_bytes", "Bytes of the files loaded per table in the last run", ["pipeline", "table"], registry=REGISTRY)
+CURSOR_LAG = Gauge("dlt_incremental_lag_seconds", "Now minus the last value of the incremental cursor", ["pipeline", "resource", "cursor"], registry=REGISTRY)
+
+HTTP_FETCHES = Gauge(
+    "dlt_http_fetches",
+    "HTTP fetches of the last run per status code (\"error\" without a response)",
+    ["pipeline", "host", "status"],
+    registry=REGISTRY,
+)
+HTTP_FETCH_SECONDS = Gauge(
+    "dlt_http_fetch_seconds",
+    "Total and slowest latency of the HTTP fetches of the last run, up to the response headers for streamed responses",
+    ["pipeline", "host", "status", "stat"],
+    registry=REGISTRY,
+)
+POSTGRES_WINDOWS = Gauge("dlt_postgres_windows", "beefy_db extraction windows of the last run", ["pipeline", "table"], registry=REGISTRY)
+POSTGRES_WINDOW_SECONDS = Gauge(
+    "dlt_postgres_window_seconds",
+    "Total and slowest query and fetch time of the beefy_db extraction windows of the last run",
+    ["pipeline", "table", "stat"],
+    registry=REGISTRY,
+)
+
+
+class RunSummary:
+    """
+    Count, total and maximum of the durations observed during a run, per label values, set on
+    the `count` and `seconds` (stat="sum" or "max") gauges of the pipeline by `record_run`.
+    """
+
+    def __init__(self, count: Gauge, seconds: Gauge) -> None:
+        self.count = count
+        self.seconds = seconds
+        # observed from the extract threads and event loops
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[Tuple[str, str], ...], list] = {}
+
+    def observe(self, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._values.setdefault(key, [0, 0.0, 0.0])
+            values[0] += 1
+            values[1] += seconds
+            values[2] = max(values[2], seconds)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def export(self, pipeline_name: str) -> None:
+        with self._lock:
+            values = list(self._values.items())
+        for key, (count, total, slowest) in values:
+            labels = dict(key, pipeline=pipeline_name)
+            self.count.labels(**labels).set(count)
+            self.seconds.labels(**labels, stat="sum").set(total)
+            self.seconds.labels(**labels, stat="max").set(slowest)
+
+
+HTTP_FETCH = RunSummary(HTTP_FETCHES, HTTP_FETCH_SECONDS)
+POSTGRES_WINDOW = RunSummary(POSTGRES_WINDOWS, POSTGRES_WINDOW_SECONDS)
+
+
+class _PipelineCollector:
+    """The REGISTRY series of one pipeline."""
+
+    def __init__(self, pipeline_name: str) -> None:
+        self.pipeline_name = pipeline_name
+
+    def collect(self) -> Iterator[Any]:
+        for metric in REGISTRY.collect():
+            metric.samples = [sample for sample in metric.samples if sample.labels.get("pipeline") == self.pipeline_name]
+            if metric.samples:
+                yield metric
+
+
+def pipeline_registry(pipeline_name: str) -> CollectorRegistry:
+    """A registry of the series of `pipeline_name` only, pipelines sharing a process export theirs separately."""
+    registry = CollectorRegistry()
+    registry.register(_PipelineCollector(pipeline_name))
+    return registry
+
+
+def _as_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def _incremental_cursors(pipeline: dlt.Pipeline) -> Iterator[Tuple[str, str, datetime]]:
+    """(resource, cursor, last value) of the datetime incremental cursors in the pipeline state."""
+    for source_state in pipeline.state.get("sources", {}).values():
+        for resource, resource_state in source_state.get("resources", {}).items():
+            for cursor, incremental in resource_state.get("incremental", {}).items():
+                last_value = _as_datetime(incremental.get("last_value"))
+                if last_value is not None:
+                    yield resource, cursor, last_value
+
+
+def bytes_per_table(load_info: Any) -> dict:
+    """Size of the files of the completed load jobs, per table."""
+    sizes: dict = {}
+    for package in load_info.load_packages:
+        for job in package.jobs.get("completed_jobs", []):
+            table = job.job_file_info.table_name
+            sizes[table] = sizes.get(table, 0) + job.file_size
+    return sizes
+
+
+def start_run(pipeline_name: str) -> None:
+    """
+    Remove the last run gauges of `pipeline_name`, so tables or cursors missing from this run
+    are not reported with the values of a previous one (warm workers run many times in a process).
+    Other pipelines sharing the process keep theirs. The run summaries start over.
+    """
+    HTTP_FETCH.reset()
+    POSTGRES_WINDOW.reset()
+    for gauge in (STAGE_SECONDS, TABLE_ROWS, TABLE_BYTES, CURSOR_LAG, HTTP_FETCHES, HTTP_FETCH_SECONDS, POSTGRES_WINDOWS, POSTGRES_WINDOW_SECONDS):
+        for metric in gauge.collect():
+            for sample in metric.samples:
+                if sample.labels.get("pipeline") == pipeline_name:
+                    gauge.remove(*sample.labels.values())
+
+
+def record_run(pipeline: dlt.Pipeline, load_info: Any) -> None:
+    """Record the metrics of the last run of `pipeline` from its trace and state."""
+    name = pipeline.pipeline_name
+    trace = pipeline.last_trace
+    if trace is not None:
+        for step in trace.steps:
+            if step.step in ("extract", "normalize", "load") and step.finished_at is not None:
+                STAGE_SECONDS.labels(pipeline=name, stage=step.step).set((step.finished_at - step.started_at).total_seconds())
+        if trace.last_normalize_info is not None:
+            for table, rows in trace.last_normalize_info.row_counts.items():
+                TABLE_ROWS.labels(pipeline=name, table=table).set(rows)
+
+    for table, size in bytes_per_table(load_info).items():
+        TABLE_BYTES.labels(pipeline=name, table=table).set(size)
+
+    now = datetime.now(timezone.utc)
+    for resource, cursor, last_value in _incremental_cursors(pipeline):
+        CURSOR_LAG.labels(pipeline=name, resource=resource, cursor=cursor).set((now - last_value).total_seconds())
+
+    # pipelines run one at a time between `start_run` and here, what was observed is theirs
+    HTTP_FETCH.export(name)
+    POSTGRES_WINDOW.export(name)
+
+
+def push_metrics(pipeline_name: str, success: bool) -> None:
+    """
+    Push the metrics of `pipeline_name` to DLT_METRICS_PUSHGATEWAY and/or write them to
+    DLT_METRICS_TEXTFILE_DIR, under its own grouping key or file.
+    """
+    LAST_RUN.labels(pipeline=pipeline_name, status="success" if success else "error").set_to_current_time()
+    registry = pipeline_registry(pipeline_name)
+    try:
+        if METRICS_PUSHGATEWAY:
+            push_to_gateway(METRICS_PUSHGATEWAY, job="dlt", grouping_key={"instance": pipeline_name}, registry=registry)
+        if METRICS_TEXTFILE_DIR:
+            write_to_textfile(os.path.join(METRICS_TEXTFILE_DIR, f"{pipeline_name}.prom"), registry)
+    except Exception as e:
+        # metrics must never fail a load
+        logger.warning("Could not export the %s metrics: %s", pipeline_name, e)
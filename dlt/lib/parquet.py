@@ -0,0 +1,33 @@
+import logging
+from typing import Any, Optional
+from dlt.common.data_writers.writers import ParquetDataWriter
+
+logger = logging.getLogger(__name__)
+
+
+def configure_parquet_compression(codec: str, level: Optional[int] = None) -> None:
+    """
+    Make the dlt parquet writers compress with `codec` (zstd, lz4, snappy, gzip or none).
+
+    dlt 1.18 does not expose the compression of its parquet writers and pyarrow defaults
+    to snappy, so the writer factory shared by the extract (arrow items) and normalize
+    writers is replaced. Normalize workers are forked and inherit it.
+    """
+    import pyarrow.parquet as pq
+
+    def _create_writer(self: ParquetDataWriter, schema: Any) -> pq.ParquetWriter:
+        return pq.ParquetWriter(
+            self._f,
+            schema,
+            flavor=self.parquet_format.flavor,
+            version=self.parquet_format.version,
+            data_page_size=self.parquet_format.data_page_size,
+            coerce_timestamps=self.parquet_format.coerce_timestamps,
+            allow_truncated_timestamps=self.parquet_format.allow_truncated_timestamps,
+            use_compliant_nested_type=self.parquet_format.use_compliant_nested_type,
+            compression=codec,
+            compression_level=level,
+        )
+
+    ParquetDataWriter._create_writer = _create_writer
+    logger.debug("parquet writers compress with %s (level %s)", codec, level)
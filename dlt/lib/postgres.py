@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, MutableMapping, Optional, Tuple
+import dlt
+import psycopg2
+import sqlalchemy as sa
+from dlt.sources.sql_database import engine_from_credentials
+from dlt.sources.sql_database.helpers import TableLoader
+from dlt.sources.sql_database.schema_types import table_to_resource_hints
+from lib.config import (
+    BEEFY_DB_BACKFILL_MAX_WINDOWS,
+    BEEFY_DB_ID_CACHE_TTL,
+    BEEFY_DB_ID_FILTER,
+    BEEFY_DB_SKIP_UNCHANGED_TABLES,
+    BEEFY_DB_WINDOW_TARGET_ROWS,
+    TRACK_ROW_CHANGES,
+    get_beefy_db_url,
+)
+from lib.changes import DELETED_COLUMNS, track_table_changes
+from lib.metrics import POSTGRES_WINDOW
+from lib.profiles import ResourceProfile
+
+logger = logging.getLogger(__name__)
+
+# builds the SELECT for one (start_value, end_value] window of the table
+TWindowQuery = Callable[[sa.Table, datetime, datetime], sa.TextClause]
+
+# ID lists used to filter the incremental tables, as (id column, table) in Postgres
+ID_LISTS = {
+    "chain_ids": ("chain_id", "chains"),
+    "oracle_ids": ("id", "price_oracles"),
+    "vault_ids": ("id", "vault_ids"),
+}
+
+_id_lists: Dict[str, List[Any]] = {}
+_id_lists_fetched_at: Optional[float] = None
+_id_lists_lock = threading.Lock()
+
+MIN_WINDOW_SIZE = timedelta(hours=1)
+MAX_WINDOW_SIZE = timedelta(days=730)
+# weight of the last window in the row density moving average
+WINDOW_DENSITY_SMOOTHING = 0.5
+# end of the chunks of a backfill window
+_WINDOW_END = object()
+
+
+def get_beefy_db_ids(name: str) -> List[Any]:
+    """
+    Get one of the `ID_LISTS`, cached for BEEFY_DB_ID_CACHE_TTL seconds.
+
+    All the lists are refreshed together with a single query on a single connection, and
+    the cache is kept at module level so it is shared by all resources and loop iterations.
+    """
+    global _id_lists_fetched_at
+
+    with _id_lists_lock:
+        if _id_lists_fetched_at is None or time.monotonic() - _id_lists_fetched_at > BEEFY_DB_ID_CACHE_TTL:
+            arrays = ", ".join(
+                f"ARRAY(SELECT DISTINCT {column} FROM {table} ORDER BY {column}) AS {list_name}"
+                for list_name, (column, table) in ID_LISTS.items()
+            )
+            conn = psycopg2.connect(get_beefy_db_url())
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"SELECT {arrays}")
+                    row = cur.fetchone()
+            finally:
+                conn.close()
+            _id_lists.clear()
+            _id_lists.update(zip(ID_LISTS.keys(), row))
+            _id_lists_fetched_at = time.monotonic()
+            logger.info("beefy_db ID lists refreshed: %s", {list_name: len(ids) for list_name, ids in _id_lists.items()})
+        return _id_lists[name]
+
+
+def id_filter(column: str, name: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    SQL condition restricting `column` to the ids of the `name` ID list, and its bind parameters.
+
+    Binds the cached list as an array by default. With BEEFY_DB_ID_FILTER=subquery, Postgres
+    does a semi-join on the ID table instead, which lets the planner use the index on `column`
+    without shipping (and parsing) the full array on every query.
+    """
+    if BEEFY_DB_ID_FILTER == "subquery":
+        id_column, id_table = ID_LISTS[name]
+        return f"{column} IN (SELECT {id_column} FROM {id_table})", {}
+    return f"{column} = ANY(:{name})", {name: get_beefy_db_ids(name)}
+
+
+class AdaptiveWindow:
+    """
+    Sizes extraction windows to hit BEEFY_DB_WINDOW_TARGET_ROWS rows per window.
+
+    The row density (rows per second of cursor time) observed on extracted windows is kept
+    as a moving average in the resource state, so it carries over to the next runs and is only
+    persisted along with a successful load. Density increases are applied right away to avoid
+    repeatedly overshooting the budget on dense periods, decreases are smoothed.
+    """
+
+    def __init__(self, state: MutableMapping[str, Any], default_size: timedelta) -> None:
+        self.state = state.setdefault("adaptive_window", {})
+        self.default_size = default_size
+
+    def next_size(self) -> timedelta:
+        rows_per_second: Optional[float] = self.state.get("rows_per_second")
+        if rows_per_second is None:
+            size = self.default_size
+        elif rows_per_second <= 0:
+            size = MAX_WINDOW_SIZE
+        else:
+            size = timedelta(seconds=BEEFY_DB_WINDOW_TARGET_ROWS / rows_per_second)
+        return min(max(size, MIN_WINDOW_SIZE), MAX_WINDOW_SIZE)
+
+    def observe(self, start_value: datetime, end_value: datetime, rows: int, elapsed: float, now: datetime) -> None:
+        # the last window usually extends in the future, only the elapsed part holds rows
+        seconds = (min(end_value, now) - start_value).total_seconds()
+        if seconds <= 0:
+            return
+
+        rows_per_second = rows / seconds
+        previous = self.state.get("rows_per_second")
+        if previous is not None and rows_per_second < previous:
+            rows_per_second = WINDOW_DENSITY_SMOOTHING * rows_per_second + (1 - WINDOW_DENSITY_SMOOTHING) * previous
+        self.state["rows_per_second"] = rows_per_second
+        self.state["last_window"] = {
+            "start_value": start_value.isoformat(),
+            "end_value": end_value.isoformat(),
+            "rows": rows,
+            "extract_rows_per_second": rows / elapsed if elapsed > 0 else None,
+        }
+
+
+def _reflect_table(table: str) -> Tuple[sa.Engine, sa.Table, Any]:
+    engine = engine_from_credentials(get_beefy_db_url())
+    table_obj = sa.Table(table, sa.MetaData(), autoload_with=engine)
+    return engine, table_obj, table_to_resource_hints(table_obj, "full_with_precision")
+
+
+def _count_rows(item: Any) -> int:
+    return getattr(item, "num_rows", 1)
+
+
+def _put(chunks: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put `item` in `chunks`, waiting for room unless `stop` is set. False if it was not put."""
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+async def windowed_sql_table(
+    table: str,
+    cursor_column: str,
+    primary_key: List[str],
+    initial_value: datetime,
+    window_size: timedelta,
+    window_query: TWindowQuery,
+    profile: ResourceProfile,
+    ddl_version: Optional[str] = None,
+) -> Any:
+    """
+    Incremental beefy_db table extracted one time window at a time.
+
+    Each run loads the rows with `cursor_column` in (cursor, cursor + window], the window being
+    sized by `AdaptiveWindow` (`window_size` is only used until a density was observed). When
+    backfilling, several consecutive windows are extracted in parallel against Postgres with at
+    most `profile.workers` queries in flight, each handing its chunks over as they are read (so
+    at most two chunks per worker are in memory). Windows are always yielded in order, so the
+    incremental cursor only moves past a window once every window below it was extracted,
+    and dlt only commits it once the whole load succeeded.
+
+    The table is reflected in a worker thread so several tables can be set up concurrently.
+    `ddl_version` is recorded in the resource state, see `lib.clickhouse.apply_table_ddl`.
+    """
+    engine, table_obj, hints = await asyncio.to_thread(_reflect_table, table)
+
+    def iter_window(start_value: datetime, end_value: datetime) -> Iterator[Any]:
+        logger.info(f"{table} window: {start_value} {end_value}")
+        loader = TableLoader(
+            engine,
+            "pyarrow",
+            table_obj,
+            hints["columns"],
+            chunk_size=profile.chunk_size,
+            query_adapter_callback=lambda query, table: window_query(table, start_value, end_value),
+        )
+        yield from loader.load_rows({"tz": "UTC"})
+
+    def load_window(start_value: datetime, end_value: datetime, chunks: queue.Queue, stop: threading.Event) -> Tuple[int, float]:
+        """Extract a window into `chunks`, blocking while it is full, until the end of the window or `stop`."""
+        started_at, rows = time.monotonic(), 0
+        try:
+            for item in iter_window(start_value, end_value):
+                rows += _count_rows(item)
+                if not _put(chunks, item, stop):
+                    # the resource was closed, stop reading (and close the server-side cursor)
+                    break
+        finally:
+            _put(chunks, _WINDOW_END, stop)
+        # includes the time spent waiting for the previous windows to be yielded
+        return rows, time.monotonic() - started_at
+
+    @dlt.resource(
+        name=table,
+        primary_key=primary_key,
+        write_disposition="append",
+        columns=hints["columns"],
+    )
+    def windowed_table_rows(
+        cursor=dlt.sources.incremental(
+            cursor_column,
+            initial_value=None,
+            primary_key=primary_key,
+            last_value_func=max,
+            row_order="asc",
+        ),
+    ) -> Iterator[Any]:
+        state = dlt.current.resource_state(table)
+        if ddl_version:
+            state["ddl_version"] = ddl_version
+        window = AdaptiveWindow(state, window_size)
+        now = datetime.now(timezone.utc)
+        start_value = cursor.start_value or initial_value
+
+        # up to date: a single window starting at the cursor
+        if profile.workers <= 1 or start_value + window.next_size() >= now:
+            end_value = start_value + window.next_size()
+            started_at, rows = time.monotonic(), 0
+            for item in iter_window(start_value, end_value):
+                rows += _count_rows(item)
+                yield item
+            elapsed = time.monotonic() - started_at
+            window.observe(start_value, end_value, rows, elapsed, now)
+            POSTGRES_WINDOW.observe(elapsed, table=table)
+            return
+
+        logger.info(f"{table} backfill from {start_value}, up to {BEEFY_DB_BACKFILL_MAX_WINDOWS} windows")
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=profile.workers, thread_name_prefix=f"{table}-backfill") as executor:
+            pending: deque = deque()
+            planned = 0
+            window_start = start_value
+            try:
+                while True:
+                    # keep one window per worker in flight, each sized from the latest density estimate.
+                    # Windows hand their chunks over through a queue of one: with the chunk being read,
+                    # at most two chunks per worker are held, as budgeted by ResourceProfile
+                    while len(pending) < profile.workers and window_start < now and planned < BEEFY_DB_BACKFILL_MAX_WINDOWS:
+                        window_end = window_start + window.next_size()
+                        chunks: queue.Queue = queue.Queue(maxsize=1)
+                        future = executor.submit(load_window, window_start, window_end, chunks, stop)
+                        pending.append((window_start, window_end, chunks, future))
+                        window_start = window_end
+                        planned += 1
+                    if not pending:
+                        break
+
+                    # yield them in cursor order, the head window as its chunks arrive
+                    window_start_value, window_end_value, chunks, future = pending[0]
+                    while (item := chunks.get()) is not _WINDOW_END:
+                        yield item
+                    pending.popleft()
+                    rows, elapsed = future.result()
+                    window.observe(window_start_value, window_end_value, rows, elapsed, now)
+                    POSTGRES_WINDOW.observe(elapsed, table=table)
+            finally:
+                # unblock the workers if the resource is closed early
+                stop.set()
+
+    return windowed_table_rows()
+
+
+def _table_write_signature(conn: sa.Connection, table: str) -> Optional[List[int]]:
+    """
+    Cumulative insert/update/delete counters of a table, from the Postgres statistics collector.
+
+    These counters are not transactional: they are reported with a delay after the commit (a write
+    committed right before a load may only be seen at the next one), count aborted writes too, and
+    are reset by pg_stat_reset and crash recovery (a reset changes the signature, so it only causes
+    an extra load). On a read replica they only reflect the replica's own activity, never the
+    replicated writes: BEEFY_DB_SKIP_UNCHANGED_TABLES is only safe against the primary, and None
+    (no signature, always load) is returned on a server in recovery.
+    """
+    if conn.execute(sa.text("SELECT pg_is_in_recovery()")).scalar():
+        logger.warning(f"beefy_db is a replica, cannot skip {table} when unchanged")
+        return None
+    row = conn.execute(
+        sa.text("SELECT n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables WHERE relname = :table"),
+        {"table": table},
+    ).first()
+    return list(row) if row is not None else None
+
+
+async def full_sql_table(table: str, primary_key: List[str], profile: ResourceProfile) -> Any:
+    """
+    beefy_db table fully reloaded on every run, merged on `primary_key`.
+
+    Rows are read through a server-side cursor (TableLoader executes with yield_per) so only
+    `profile.chunk_size` rows are held in memory at once, converted straight to arrow.
+    With BEEFY_DB_SKIP_UNCHANGED_TABLES the table is skipped when its write counters did not
+    move since the last load, with TRACK_ROW_CHANGES only the changed rows are loaded.
+    """
+    engine, table_obj, hints = await asyncio.to_thread(_reflect_table, table)
+    columns = {**hints["columns"], **DELETED_COLUMNS}
+
+    @dlt.resource(
+        name=table,
+        primary_key=primary_key,
+        write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+        columns=columns,
+    )
+    def full_table_rows() -> Iterator[Any]:
+        state = dlt.current.resource_state(table)
+        if BEEFY_DB_SKIP_UNCHANGED_TABLES:
+            with engine.connect() as conn:
+                signature = _table_write_signature(conn, table)
+            if signature is not None and signature == state.get("write_signature"):
+                logger.info(f"{table} unchanged since last load, skipping")
+                return
+            state["write_signature"] = signature
+
+        loader = TableLoader(engine, "pyarrow", table_obj, hints["columns"], chunk_size=profile.chunk_size)
+        rows = loader.load_rows({"tz": "UTC"})
+        if TRACK_ROW_CHANGES:
+            rows = track_table_changes(table, rows, state, primary_key)
+        yield from rows
+
+    return full_table_rows()
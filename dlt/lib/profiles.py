@@ -0,0 +1,105 @@
+import math
+import os
+from dataclasses import dataclass
+import psutil
+from lib.config import BATCH_SIZE
+
+# share of the available memory the buffers of a pipeline (or the chunks of a resource) may use
+PROFILE_MEMORY_FRACTION = float(os.environ.get("DLT_PROFILE_MEMORY_FRACTION", "0.25"))
+MIN_ITEMS = 1_000
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects the container cpuset)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return psutil.cpu_count() or 1
+
+
+def available_memory() -> int:
+    """Available memory in bytes, capped by the cgroup v2 limit when running in a container."""
+    available = psutil.virtual_memory().available
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as f:
+            current = int(f.read().strip())
+        if limit != "max":
+            available = min(available, int(limit) - current)
+    except (OSError, ValueError):
+        pass
+    return max(available, 0)
+
+
+def _clamp(value: float, low: int, high: int) -> int:
+    return int(max(low, min(high, value)))
+
+
+@dataclass(frozen=True)
+class PipelineProfile:
+    """dlt workers and writer buffers of a pipeline."""
+
+    extract_workers: int
+    normalize_workers: int
+    load_workers: int
+    buffer_max_items: int
+    file_max_items: int
+
+    @classmethod
+    def auto(cls, rows_per_run: int, row_bytes: int, parallel_resources: int) -> "PipelineProfile":
+        """
+        Size a profile for the expected volume of a run on this host.
+
+        Extract and load are I/O bound and get up to 2 workers per CPU, capped by the number of
+        resources that can actually run in parallel. Writer buffers (one per table being written)
+        share PROFILE_MEMORY_FRACTION of the available memory. Files are sized so a run splits in
+        about one file per CPU, and normalize gets one worker per file.
+        """
+        cpus = available_cpus()
+        memory_budget = available_memory() * PROFILE_MEMORY_FRACTION
+        max_items = max(min(rows_per_run, BATCH_SIZE), MIN_ITEMS)
+
+        io_workers = _clamp(parallel_resources, 1, 2 * cpus)
+        buffer_max_items = _clamp(memory_budget / (row_bytes * io_workers), MIN_ITEMS, max_items)
+        file_max_items = _clamp(math.ceil(rows_per_run / cpus), buffer_max_items, BATCH_SIZE)
+        normalize_workers = _clamp(math.ceil(rows_per_run / file_max_items), 1, cpus)
+
+        return cls(
+            extract_workers=io_workers,
+            normalize_workers=normalize_workers,
+            load_workers=io_workers,
+            buffer_max_items=buffer_max_items,
+            file_max_items=file_max_items,
+        )
+
+    def apply(self, pipeline_name: str) -> None:
+        """Set the profile as dlt configuration, scoped to `pipeline_name` so pipelines sharing a process keep their own."""
+        prefix = pipeline_name.upper()
+        os.environ[f"{prefix}__EXTRACT__WORKERS"] = str(self.extract_workers)
+        os.environ[f"{prefix}__NORMALIZE__WORKERS"] = str(self.normalize_workers)
+        os.environ[f"{prefix}__LOAD__WORKERS"] = str(self.load_workers)
+        for step in ["EXTRACT", "NORMALIZE", "LOAD"]:
+            os.environ[f"{prefix}__{step}__DATA_WRITER__BUFFER_MAX_ITEMS"] = str(self.buffer_max_items)
+            os.environ[f"{prefix}__{step}__DATA_WRITER__FILE_MAX_ITEMS"] = str(self.file_max_items)
+
+
+@dataclass(frozen=True)
+class ResourceProfile:
+    """Rows fetched per chunk, and concurrent fetches, of a resource."""
+
+    chunk_size: int
+    workers: int
+
+    @classmethod
+    def auto(cls, row_bytes: int, max_chunk_size: int = BATCH_SIZE, max_workers: int = 1) -> "ResourceProfile":
+        """
+        Size a profile for rows of `row_bytes` on this host.
+
+        Up to `max_workers` concurrent fetches, one per CPU. Each fetch holds about two chunks
+        (the driver buffer and the chunk being converted) within PROFILE_MEMORY_FRACTION of the
+        available memory.
+        """
+        workers = _clamp(available_cpus(), 1, max_workers)
+        memory_budget = available_memory() * PROFILE_MEMORY_FRACTION
+        chunk_size = _clamp(memory_budget / (row_bytes * workers * 2), MIN_ITEMS, max_chunk_size)
+        return cls(chunk_size=chunk_size, workers=workers)
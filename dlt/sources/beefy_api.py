@@ -4,9 +4,16 @@ from typing import Any
 import dlt
 from .resources.beefy_api.configs import get_beefy_api_configs_resources
 from .resources.beefy_api.snapshots import get_beefy_api_snapshots_resources
+from lib.profiles import PipelineProfile
 
 logger = logging.getLogger(__name__)
 
+def pipeline_profile() -> PipelineProfile:
+    """Profile of the beefy_api pipeline, sized from the resources of this host when the pipeline is built."""
+    # workers and writer buffers of the beefy_api pipeline: ~100k JSON rows across 15 resources (see lib/profiles.py)
+    return PipelineProfile.auto(rows_per_run=100_000, row_bytes=2048, parallel_resources=15)
+
+
 @dlt.source(
     name="beefy_api", 
     max_table_nesting=0, 
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from typing import Any
 import dlt
@@ -7,20 +8,31 @@ from .resources.beefy_db.tvls import get_beefy_db_tvls_resource
 from .resources.beefy_db.apys import get_beefy_db_apys_resource
 from .resources.beefy_db.tvl_by_chain import get_beefy_db_tvl_by_chain_resource
 from .resources.beefy_db.tables import get_beefy_db_other_tables_resources
+from lib.config import BEEFY_DB_WINDOW_TARGET_ROWS
+from lib.profiles import PipelineProfile
 
 logger = logging.getLogger(__name__)
 
+def pipeline_profile() -> PipelineProfile:
+    """Profile of the beefy_db pipeline, sized from the resources of this host when the pipeline is built."""
+    # workers and writer buffers of the beefy_db pipeline, sized for a run of backfill windows
+    # over the 5 incremental tables (see lib/profiles.py)
+    return PipelineProfile.auto(rows_per_run=5 * BEEFY_DB_WINDOW_TARGET_ROWS, row_bytes=128, parallel_resources=12)
+
+
 @dlt.source(name="beefy_db", parallelized=True)
 async def beefy_db_source() -> Any:
     """Expose Beefy DB resources for use by dlt pipelines."""
 
-    resources = [
-        await get_beefy_db_harvests_resource(),
-        await get_beefy_db_prices_resource(),
-        await get_beefy_db_tvls_resource(),
-        await get_beefy_db_apys_resource(),
-        await get_beefy_db_tvl_by_chain_resource(),
-    ]
-    resources.extend(get_beefy_db_other_tables_resources())
+    # ClickHouse DDL and Postgres reflection of all tables run concurrently
+    *resources, other_tables_resources = await asyncio.gather(
+        get_beefy_db_harvests_resource(),
+        get_beefy_db_prices_resource(),
+        get_beefy_db_tvls_resource(),
+        get_beefy_db_apys_resource(),
+        get_beefy_db_tvl_by_chain_resource(),
+        get_beefy_db_other_tables_resources(),
+    )
+    resources.extend(other_tables_resources)
 
     return resources
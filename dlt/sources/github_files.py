@@ -3,9 +3,16 @@ import logging
 from typing import Any, AsyncIterator, Dict
 import dlt
 from .resources.github_files.ui_repo import get_github_files_ui_repo_resources
+from lib.profiles import PipelineProfile
 
 logger = logging.getLogger(__name__)
 
+def pipeline_profile() -> PipelineProfile:
+    """Profile of the github_files pipeline, sized from the resources of this host when the pipeline is built."""
+    # workers and writer buffers of the github_files pipeline: a few small files (see lib/profiles.py)
+    return PipelineProfile.auto(rows_per_run=1_000, row_bytes=1024, parallel_resources=2)
+
+
 @dlt.source(
     name="github_files", 
     max_table_nesting=0, 
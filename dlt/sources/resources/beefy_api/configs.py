@@ -2,7 +2,8 @@ from __future__ import annotations
 import logging
 from typing import Any, AsyncIterator, Dict
 import dlt
-from lib.fetch import fetch_url_json_dict, fetch_url_json_list
+from lib.changes import DELETED_COLUMNS, track_row_changes
+from lib.fetch import stream_url_json, stream_url_json_list
 
 logger = logging.getLogger(__name__)
 
@@ -14,9 +15,11 @@ async def get_beefy_api_configs_resources() -> Any:
         name="vaults",
         primary_key="id",
         write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+        columns=DELETED_COLUMNS,
     )
+    @track_row_changes("vaults", ["id"])
     async def beefy_vaults() -> AsyncIterator[Dict[str, Any]]:
-        async for item in fetch_url_json_list("https://api.beefy.finance/vaults"):
+        async for item in stream_url_json_list("https://api.beefy.finance/vaults"):
             # prevent crashes where python tries to convert the total supply to an Int and it's too large
             if "totalSupply" in item:
                 item["totalSupply"] = str(item["totalSupply"])
@@ -27,9 +30,11 @@ async def get_beefy_api_configs_resources() -> Any:
         name="gov_vaults",
         primary_key="id",
         write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+        columns=DELETED_COLUMNS,
     )
+    @track_row_changes("gov_vaults", ["id"])
     async def beefy_gov_vaults() -> AsyncIterator[Dict[str, Any]]:
-        async for item in fetch_url_json_list("https://api.beefy.finance/gov-vaults"):
+        async for item in stream_url_json_list("https://api.beefy.finance/gov-vaults"):
             # prevent crashes where python tries to convert the total supply to an Int and it's too large
             if "totalSupply" in item:
                 item["totalSupply"] = str(item["totalSupply"])
@@ -40,9 +45,11 @@ async def get_beefy_api_configs_resources() -> Any:
         name="boosts",
         primary_key="id",
         write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+        columns=DELETED_COLUMNS,
     )
+    @track_row_changes("boosts", ["id"])
     async def beefy_boosts() -> AsyncIterator[Dict[str, Any]]:
-        async for item in fetch_url_json_list("https://api.beefy.finance/boosts"):
+        async for item in stream_url_json_list("https://api.beefy.finance/boosts"):
             yield item
 
 
@@ -51,11 +58,13 @@ async def get_beefy_api_configs_resources() -> Any:
         primary_key="id",
         write_disposition={"disposition": "merge", "strategy": "delete-insert"},
         columns={
+            **DELETED_COLUMNS,
             "feeTier": {"data_type": "text"},
         },
     )
+    @track_row_changes("clm_vaults", ["id"])
     async def beefy_clm_vaults() -> AsyncIterator[Dict[str, Any]]:
-        async for item in fetch_url_json_list("https://api.beefy.finance/clm-vaults"):
+        async for item in stream_url_json_list("https://api.beefy.finance/clm-vaults"):
             # prevent crashes where python tries to convert the total supply to an Int and it's too large
             if "totalSupply" in item:
                 item["totalSupply"] = str(item["totalSupply"])
@@ -73,9 +82,11 @@ async def get_beefy_api_configs_resources() -> Any:
         name="cow_vaults",
         primary_key="id",
         write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+        columns=DELETED_COLUMNS,
     )
+    @track_row_changes("cow_vaults", ["id"])
     async def beefy_cow_vaults() -> AsyncIterator[Dict[str, Any]]:
-        async for item in fetch_url_json_list("https://api.beefy.finance/cow-vaults"):
+        async for item in stream_url_json_list("https://api.beefy.finance/cow-vaults"):
             # prevent crashes where python tries to convert the total supply to an Int and it's too large
             if "totalSupply" in item:
                 item["totalSupply"] = str(item["totalSupply"])
@@ -86,16 +97,17 @@ async def get_beefy_api_configs_resources() -> Any:
         name="tokens",
         primary_key=["chainId", "id"],
         write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+        columns=DELETED_COLUMNS,
     )
+    @track_row_changes("tokens", ["chainId", "id"])
     async def beefy_tokens() -> AsyncIterator[Dict[str, Any]]:
-        payload, _ = await fetch_url_json_dict("https://api.beefy.finance/tokens")
-        
-        # Flatten the nested structure: iterate through chains and tokens
-        for chain_id, tokens in payload.items():
-            for token_id, token_data in tokens.items():
-                # Ensure chainId is set in the token data
-                token_data["chainId"] = chain_id
-                yield token_data
+        async with stream_url_json("https://api.beefy.finance/tokens") as stream:
+            # Flatten the nested structure: iterate through chains and tokens
+            async for chain_id, tokens in stream.kvitems():
+                for token_id, token_data in tokens.items():
+                    # Ensure chainId is set in the token data
+                    token_data["chainId"] = chain_id
+                    yield token_data
 
 
     return [beefy_vaults(), beefy_gov_vaults(), beefy_clm_vaults(), beefy_cow_vaults(), beefy_boosts(), beefy_tokens()]
@@ -3,11 +3,31 @@ from __future__ import annotations
 from datetime import datetime, timezone
 from typing import Any, AsyncIterator, Dict
 import dlt
-from lib.fetch import fetch_url_json_dict
-from lib.convert import get_int_like
+import pyarrow as pa
+from lib.fetch import fetch_url_json_dict_if_modified, stream_url_json
+from lib.convert import get_int_like, to_float
+
+
+def _snapshot_table(etag: str, now: datetime, columns: Dict[str, pa.Array]) -> pa.Table:
+    """Build an arrow batch from snapshot columns, adding the constant etag and date_time columns."""
+    num_rows = len(next(iter(columns.values())))
+    return pa.table({
+        "etag": pa.array([etag] * num_rows, type=pa.string()),
+        **columns,
+        "date_time": pa.array([now] * num_rows, type=pa.timestamp("us", tz="UTC")),
+    })
 
 
 async def get_beefy_api_snapshots_resources() -> Any:
+    """
+    Expose Beefy API snapshot resources for use by dlt pipelines.
+
+    Snapshots are fetched with a conditional GET: when the API answers 304 Not Modified the
+    resource yields no rows, so that run writes no snapshot at all, instead of a copy of the
+    previous one with a new date_time. Rows are only written when the payload changes, and
+    consumers needing one value per period must carry the last snapshot forward (as of its
+    date_time) rather than expect a row per run.
+    """
 
     @dlt.resource(
         name="apy",
@@ -17,17 +37,17 @@ async def get_beefy_api_snapshots_resources() -> Any:
             "apy": {"data_type": "double"},
         },
     )
-    async def beefy_apy() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/apy")
+    async def beefy_apy() -> AsyncIterator[pa.Table]:
+        result = await fetch_url_json_dict_if_modified("https://api.beefy.finance/apy", dlt.current.resource_state("apy"))
+        if result is None:
+            return
+        payload, etag = result
         now = datetime.now(timezone.utc)
         etag_value = etag or now.isoformat()
-        for vault_id, vault_apy in payload.items():
-            yield {
-                "etag": etag_value,
-                "vault_id": vault_id,
-                "apy": str(vault_apy),
-                "date_time": now,
-            }
+        yield _snapshot_table(etag_value, now, {
+            "vault_id": pa.array(list(payload.keys()), type=pa.string()),
+            "apy": pa.array([to_float(v) for v in payload.values()], type=pa.float64()),
+        })
 
     @dlt.resource(
         name="lps",
@@ -37,17 +57,17 @@ async def get_beefy_api_snapshots_resources() -> Any:
             "lps": {"data_type": "double"},
         },
     )
-    async def beefy_lps() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/lps")
+    async def beefy_lps() -> AsyncIterator[pa.Table]:
+        result = await fetch_url_json_dict_if_modified("https://api.beefy.finance/lps", dlt.current.resource_state("lps"))
+        if result is None:
+            return
+        payload, etag = result
         now = datetime.now(timezone.utc)
         etag_value = etag or now.isoformat()
-        for vault_id, vault_lps in payload.items():
-            yield {
-                "etag": etag_value,
-                "vault_id": vault_id,
-                "lps": str(vault_lps),
-                "date_time": now,
-            }
+        yield _snapshot_table(etag_value, now, {
+            "vault_id": pa.array(list(payload.keys()), type=pa.string()),
+            "lps": pa.array([to_float(v) for v in payload.values()], type=pa.float64()),
+        })
 
     @dlt.resource(
         name="prices",
@@ -57,17 +77,17 @@ async def get_beefy_api_snapshots_resources() -> Any:
             "price": {"data_type": "double"},
         },
     )
-    async def beefy_prices() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/prices")
+    async def beefy_prices() -> AsyncIterator[pa.Table]:
+        result = await fetch_url_json_dict_if_modified("https://api.beefy.finance/prices", dlt.current.resource_state("prices"))
+        if result is None:
+            return
+        payload, etag = result
         now = datetime.now(timezone.utc)
         etag_value = etag or now.isoformat()
-        for token_symbol, price in payload.items():
-            yield {
-                "etag": etag_value,
-                "token_symbol": token_symbol,
-                "price": str(price),
-                "date_time": now,
-            }
+        yield _snapshot_table(etag_value, now, {
+            "token_symbol": pa.array(list(payload.keys()), type=pa.string()),
+            "price": pa.array([to_float(v) for v in payload.values()], type=pa.float64()),
+        })
 
     @dlt.resource(
         name="lps_breakdown",
@@ -81,18 +101,19 @@ async def get_beefy_api_snapshots_resources() -> Any:
         },
     )
     async def beefy_lps_breakdown() -> AsyncIterator[Dict[str, Any]]:
-        import json
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/lps/breakdown")
-        now = datetime.now(timezone.utc)
-        etag_value = etag or now.isoformat()
-        for vault_id, breakdown in payload.items():
-            # Process breakdown: stringify arrays/dicts as JSON, convert other values to strings
-            yield {
-                "etag": etag_value,
-                "vault_id": str(vault_id),
-                "date_time": now,
-                **breakdown,
-            }
+        async with stream_url_json("https://api.beefy.finance/lps/breakdown", dlt.current.resource_state("lps_breakdown")) as stream:
+            if stream.not_modified:
+                return
+            now = datetime.now(timezone.utc)
+            etag_value = stream.etag or now.isoformat()
+            async for vault_id, breakdown in stream.kvitems():
+                # Process breakdown: stringify arrays/dicts as JSON, convert other values to strings
+                yield {
+                    "etag": etag_value,
+                    "vault_id": str(vault_id),
+                    "date_time": now,
+                    **breakdown,
+                }
 
     @dlt.resource(
         name="apy_breakdown",
@@ -111,18 +132,20 @@ async def get_beefy_api_snapshots_resources() -> Any:
         },
     )
     async def beefy_apy_breakdown() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/apy/breakdown")
-        now = datetime.now(timezone.utc)
-        etag_value = etag or now.isoformat()
-        for vault_id, breakdown in payload.items():
-            # stringify the breakdown
-            breakdown = {k: str(v) for k, v in breakdown.items()}
-            yield {
-                "etag": etag_value,
-                "vault_id": str(vault_id),
-                "date_time": now,
-                **breakdown,
-            }
+        async with stream_url_json("https://api.beefy.finance/apy/breakdown", dlt.current.resource_state("apy_breakdown")) as stream:
+            if stream.not_modified:
+                return
+            now = datetime.now(timezone.utc)
+            etag_value = stream.etag or now.isoformat()
+            async for vault_id, breakdown in stream.kvitems():
+                # stringify the breakdown
+                breakdown = {k: str(v) for k, v in breakdown.items()}
+                yield {
+                    "etag": etag_value,
+                    "vault_id": str(vault_id),
+                    "date_time": now,
+                    **breakdown,
+                }
 
     @dlt.resource(
         name="tvl",
@@ -132,19 +155,24 @@ async def get_beefy_api_snapshots_resources() -> Any:
             "tvl": {"data_type": "double"},
         },
     )
-    async def beefy_tvl() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/tvl")
+    async def beefy_tvl() -> AsyncIterator[pa.Table]:
+        result = await fetch_url_json_dict_if_modified("https://api.beefy.finance/tvl", dlt.current.resource_state("tvl"))
+        if result is None:
+            return
+        payload, etag = result
         now = datetime.now(timezone.utc)
         etag_value = etag or now.isoformat()
+        network_ids, vault_ids, tvls = [], [], []
         for network_id, vaults in payload.items():
             for vault_id, tvl in vaults.items():
-                yield {
-                    "etag": etag_value,
-                    "network_id": str(network_id),
-                    "vault_id": str(vault_id),
-                    "tvl": float(tvl) if tvl is not None else None,
-                    "date_time": now,
-                }
+                network_ids.append(str(network_id))
+                vault_ids.append(str(vault_id))
+                tvls.append(to_float(tvl))
+        yield _snapshot_table(etag_value, now, {
+            "network_id": pa.array(network_ids, type=pa.string()),
+            "vault_id": pa.array(vault_ids, type=pa.string()),
+            "tvl": pa.array(tvls, type=pa.float64()),
+        })
 
     @dlt.resource(
         name="mootokenprices",
@@ -154,19 +182,24 @@ async def get_beefy_api_snapshots_resources() -> Any:
             "price": {"data_type": "double"},
         },
     )
-    async def beefy_mootokenprices() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/mootokenprices")
+    async def beefy_mootokenprices() -> AsyncIterator[pa.Table]:
+        result = await fetch_url_json_dict_if_modified("https://api.beefy.finance/mootokenprices", dlt.current.resource_state("mootokenprices"))
+        if result is None:
+            return
+        payload, etag = result
         now = datetime.now(timezone.utc)
         etag_value = etag or now.isoformat()
+        chain_ids, moo_token_symbols, prices = [], [], []
         for chain_id, vaults in payload.items():
             for moo_token_symbol, price in vaults.items():
-                yield {
-                    "etag": etag_value,
-                    "chain_id": str(chain_id),
-                    "moo_token_symbol": str(moo_token_symbol),
-                    "price": float(price) if price is not None else None,
-                    "date_time": now,
-                }
+                chain_ids.append(str(chain_id))
+                moo_token_symbols.append(str(moo_token_symbol))
+                prices.append(to_float(price))
+        yield _snapshot_table(etag_value, now, {
+            "chain_id": pa.array(chain_ids, type=pa.string()),
+            "moo_token_symbol": pa.array(moo_token_symbols, type=pa.string()),
+            "price": pa.array(prices, type=pa.float64()),
+        })
 
     @dlt.resource(
         name="treasury",
@@ -179,23 +212,25 @@ async def get_beefy_api_snapshots_resources() -> Any:
         },
     )
     async def beefy_treasury() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/treasury")
-        now = datetime.now(timezone.utc)
-        etag_value = etag or now.isoformat()
-        for chain_id, wallets in payload.items():
-            for wallet_address, wallet_data in wallets.items():
-                for token_address_or_native, token_data in wallet_data.get("balances", {}).items():
-                    token_data = { k: str(v) for k, v in token_data.items() if v is not None }
-                    token_data["usdValue"] = get_int_like(token_data, "usdValue")
-                    yield {
-                        "etag": etag_value,
-                        "chain_id": str(chain_id),
-                        "wallet_address": str(wallet_address),
-                        "wallet_name": wallet_data.get("name", ""),
-                        "token_address": str(token_address_or_native),
-                        "date_time": now,
-                        **token_data,
-                    }
+        async with stream_url_json("https://api.beefy.finance/treasury", dlt.current.resource_state("treasury")) as stream:
+            if stream.not_modified:
+                return
+            now = datetime.now(timezone.utc)
+            etag_value = stream.etag or now.isoformat()
+            async for chain_id, wallets in stream.kvitems():
+                for wallet_address, wallet_data in wallets.items():
+                    for token_address_or_native, token_data in wallet_data.get("balances", {}).items():
+                        token_data = { k: str(v) for k, v in token_data.items() if v is not None }
+                        token_data["usdValue"] = get_int_like(token_data, "usdValue")
+                        yield {
+                            "etag": etag_value,
+                            "chain_id": str(chain_id),
+                            "wallet_address": str(wallet_address),
+                            "wallet_name": wallet_data.get("name", ""),
+                            "token_address": str(token_address_or_native),
+                            "date_time": now,
+                            **token_data,
+                        }
 
     @dlt.resource(
         name="treasury_mm",
@@ -208,7 +243,10 @@ async def get_beefy_api_snapshots_resources() -> Any:
         },
     )
     async def beefy_treasury_mm() -> AsyncIterator[Dict[str, Any]]:
-        payload, etag = await fetch_url_json_dict("https://api.beefy.finance/treasury/mm")
+        result = await fetch_url_json_dict_if_modified("https://api.beefy.finance/treasury/mm", dlt.current.resource_state("treasury_mm"))
+        if result is None:
+            return
+        payload, etag = result
         now = datetime.now(timezone.utc)
         etag_value = etag or now.isoformat()
         for mm_id, exchanges in payload.items():
@@ -2,12 +2,11 @@
 import logging
 from typing import Any
 from datetime import datetime, timedelta, timezone
-import dlt
-import psycopg2
 import sqlalchemy as sa
-from dlt.sources.sql_database import sql_table
-from lib.config import BATCH_SIZE, get_beefy_db_url
-from lib.clickhouse import get_clickhouse_client
+from lib.clickhouse import apply_table_ddl
+from lib.config import BEEFY_DB_BACKFILL_WORKERS
+from lib.postgres import id_filter, windowed_sql_table
+from lib.profiles import ResourceProfile
 
 logger = logging.getLogger(__name__)
 
@@ -44,64 +43,39 @@ TABLE_SQL = f"""
     SETTINGS index_granularity = 8192;
 """
 
-CHAINS_SQL = "SELECT DISTINCT chain_id FROM chains ORDER BY chain_id"
-        
 
-async def _init_resource() -> list[int]:
-    client = await get_clickhouse_client()
-    await client.query(TABLE_SQL)
+async def _init_resource() -> str:
+    return await apply_table_ddl(RESOURCE_NAME, FULL_TABLE_NAME, TABLE_SQL)
 
-    conn = psycopg2.connect(get_beefy_db_url())
-    try:
-        with conn.cursor() as cur:
-            cur.execute(CHAINS_SQL)
-            return [row[0] for row in cur.fetchall()]
-    finally:
-        conn.close()
 
-        
 async def get_beefy_db_harvests_resource() -> Any:
-    chain_ids = await _init_resource()
+    ddl_version = await _init_resource()
 
     # # Harvests table 
-    def harvests_query_adapter_callback(query, table, incremental=None, engine=None):
-        start_value = incremental.start_value
-        if start_value is None:
-            start_value = datetime(2022, 1, 13, 0, 0, 0, tzinfo=timezone.utc) #  2022-01-13 08:32:56+00
-
-        end_value = start_value + timedelta(days=DATE_RANGE_SIZE_IN_DAYS)
-
-        logger.info(f"harvests_query_adapter_callback: {start_value} {end_value}")
-
+    def harvests_window_query(table, start_value, end_value):
+        ids_filter, ids_params = id_filter("chain_id", "chain_ids")
         return sa.text(f"""
             SELECT *
             FROM {table.fullname} 
-            WHERE chain_id = ANY(:chain_ids) 
+            WHERE {ids_filter} 
             AND txn_timestamp > :start_value 
             AND txn_timestamp <= :end_value 
         """).bindparams(**{
             "start_value": start_value,
             "end_value": end_value,
-            "chain_ids": chain_ids,
+            **ids_params,
         })
         
-    harvests = sql_table(
-        credentials=get_beefy_db_url(),
+    harvests = await windowed_sql_table(
         table=RESOURCE_NAME,
-        backend="pyarrow",
-        chunk_size=BATCH_SIZE,
-        backend_kwargs={"tz": "UTC"},
-        reflection_level="full_with_precision",
-        query_adapter_callback=harvests_query_adapter_callback,
+        cursor_column="txn_timestamp",
         primary_key=["chain_id", "block_number", "txn_idx", "event_idx"],
-        write_disposition="append",
-        incremental=dlt.sources.incremental(
-            "txn_timestamp", 
-            initial_value=None,
-            primary_key=["chain_id", "block_number", "txn_idx", "event_idx"],
-            last_value_func=max,
-            row_order="asc" 
-        ),
+        initial_value=datetime(2022, 1, 13, 0, 0, 0, tzinfo=timezone.utc), #  2022-01-13 08:32:56+00
+        window_size=timedelta(days=DATE_RANGE_SIZE_IN_DAYS),
+        window_query=harvests_window_query,
+        # fetch chunks and backfill workers, sized from the arrow row size on this host (see lib/profiles.py)
+        profile=ResourceProfile.auto(row_bytes=512, max_workers=BEEFY_DB_BACKFILL_WORKERS),
+        ddl_version=ddl_version,
     )
     harvests.apply_hints(
         columns=[
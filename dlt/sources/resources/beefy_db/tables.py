@@ -1,10 +1,12 @@
+import asyncio
 from typing import Any
-from dlt.sources.sql_database import sql_table
-from lib.config import BATCH_SIZE, get_beefy_db_url
+from lib.config import BEEFY_DB_STREAM_CHUNK_SIZE
+from lib.postgres import full_sql_table
+from lib.profiles import ResourceProfile
 
-def get_beefy_db_other_tables_resources() -> list[Any]:
-    
-    db_url = get_beefy_db_url()
+async def get_beefy_db_other_tables_resources() -> list[Any]:
+    # fetch chunks of the full reload tables, sized for wide rows on this host (see lib/profiles.py)
+    profile = ResourceProfile.auto(row_bytes=512, max_chunk_size=BEEFY_DB_STREAM_CHUNK_SIZE)
 
     tables = {
         "address_metadata": [
@@ -31,20 +33,15 @@ def get_beefy_db_other_tables_resources() -> list[Any]:
         ]
     }
 
-    resources = []
-    for table_name, columns in tables.items():
-        primary_key_columns = [column["name"] for column in columns if "primary_key" in column and column["primary_key"]]
-        resource = sql_table(
-            credentials=db_url,
+    resources = await asyncio.gather(*[
+        full_sql_table(
             table=table_name,
-            backend="sqlalchemy",
-            chunk_size=BATCH_SIZE,
-            backend_kwargs={"tz": "UTC"},
-            reflection_level="full_with_precision",
-            primary_key=primary_key_columns,
-            write_disposition={"disposition": "merge", "strategy": "delete-insert"},
+            primary_key=[column["name"] for column in columns if "primary_key" in column and column["primary_key"]],
+            profile=profile,
         )
+        for table_name, columns in tables.items()
+    ])
+    for resource, columns in zip(resources, tables.values()):
         resource.apply_hints(columns=columns)
-        resources.append(resource)
 
-    return resources
\ No newline at end of file
+    return resources
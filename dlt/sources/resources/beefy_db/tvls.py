@@ -1,12 +1,11 @@
 import logging
 from typing import Any
 from datetime import datetime, timedelta, timezone
-import dlt
-import psycopg2
 import sqlalchemy as sa
-from dlt.sources.sql_database import sql_table
-from lib.config import BATCH_SIZE, get_beefy_db_url
-from lib.clickhouse import get_clickhouse_client
+from lib.clickhouse import apply_table_ddl
+from lib.config import BEEFY_DB_BACKFILL_WORKERS
+from lib.postgres import id_filter, windowed_sql_table
+from lib.profiles import ResourceProfile
 
 logger = logging.getLogger(__name__)
 
@@ -30,64 +29,39 @@ TABLE_SQL = f"""
     SETTINGS index_granularity = 8192;
 """
 
-VAULT_IDS_SQL = "SELECT DISTINCT id FROM vault_ids"
 
+async def _init_resource() -> str:
+    return await apply_table_ddl(RESOURCE_NAME, FULL_TABLE_NAME, TABLE_SQL)
 
-async def _init_resource() -> list[int]:
-    client = await get_clickhouse_client()
-    await client.query(TABLE_SQL)
-
-    conn = psycopg2.connect(get_beefy_db_url())
-    try:
-        with conn.cursor() as cur:
-            cur.execute(VAULT_IDS_SQL)
-            return [row[0] for row in cur.fetchall()]
-    finally:
-        conn.close()
-    
 
 async def get_beefy_db_tvls_resource() -> Any:
-    vault_ids = await _init_resource()
+    ddl_version = await _init_resource()
 
     # # TVLs table
-    def tvls_query_adapter_callback(query, table, incremental=None, engine=None):
-        start_value = incremental.start_value
-        if start_value is None:
-            start_value = datetime(2021, 7, 31, 0, 0, 0, tzinfo=timezone.utc) #  2021-07-31 19:30:00+00
-
-        end_value = start_value + timedelta(days=DATE_RANGE_SIZE_IN_DAYS)
-
-        logger.info(f"tvls_query_adapter_callback: {start_value} {end_value}")
-
+    def tvls_window_query(table, start_value, end_value):
+        ids_filter, ids_params = id_filter("vault_id", "vault_ids")
         return sa.text(f"""
             SELECT * 
             FROM {table.fullname}
-            WHERE vault_id = ANY(:vault_ids)
+            WHERE {ids_filter}
             AND t > :start_value
             AND t <= :end_value
         """).bindparams(**{
             "start_value": start_value,
             "end_value": end_value,
-            "vault_ids": vault_ids,
+            **ids_params,
         })
 
-    tvls = sql_table(
-        credentials=get_beefy_db_url(),
+    tvls = await windowed_sql_table(
         table=RESOURCE_NAME,
-        backend="pyarrow",
-        chunk_size=BATCH_SIZE,
-        backend_kwargs={"tz": "UTC"},
-        reflection_level="full_with_precision",
-        query_adapter_callback=tvls_query_adapter_callback,
+        cursor_column="t",
         primary_key=["vault_id", "t"],
-        write_disposition="append", 
-        incremental=dlt.sources.incremental(
-            "t", 
-            initial_value=None,
-            primary_key=["vault_id", "t"],
-            last_value_func=max,
-            row_order="asc" 
-        ),
+        initial_value=datetime(2021, 7, 31, 0, 0, 0, tzinfo=timezone.utc), #  2021-07-31 19:30:00+00
+        window_size=timedelta(days=DATE_RANGE_SIZE_IN_DAYS),
+        window_query=tvls_window_query,
+        # fetch chunks and backfill workers, sized from the arrow row size on this host (see lib/profiles.py)
+        profile=ResourceProfile.auto(row_bytes=48, max_workers=BEEFY_DB_BACKFILL_WORKERS),
+        ddl_version=ddl_version,
     )
     tvls.apply_hints(
         columns=[
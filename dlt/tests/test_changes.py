@@ -0,0 +1,84 @@
+import asyncio
+import pyarrow as pa
+from lib.changes import DELETED_COLUMN, track_item_changes, track_table_changes
+
+
+def load(rows, state, schema=None, primary_key=("chain_id", "address")):
+    schema = schema or SCHEMA
+    batches = [pa.Table.from_pylist(rows, schema=schema)] if rows else []
+    tables = list(track_table_changes("products", iter(batches), state, primary_key))
+    return pa.concat_tables(tables, promote_options="default").to_pylist() if tables else []
+
+
+def load_items(rows, state):
+    async def items():
+        for row in rows:
+            yield row
+
+    async def collect():
+        return [item async for item in track_item_changes("products", items(), state, ["chain_id", "address"])]
+
+    return asyncio.run(collect())
+
+
+SCHEMA = pa.schema([("chain_id", pa.int64()), ("address", pa.string()), ("tvl", pa.float64()), ("tags", pa.list_(pa.string()))])
+
+
+def test_track_table_changes():
+    state = {}
+    rows = [
+        {"chain_id": 1, "address": "0xa", "tvl": 1.0, "tags": ["x"]},
+        {"chain_id": 1, "address": "0xb", "tvl": None, "tags": []},
+        {"chain_id": 2, "address": "0xa", "tvl": 3.0, "tags": None},
+    ]
+    assert len(load(rows, state)) == 3
+    assert load(rows, state) == []
+
+    updated = [{**rows[0], "tags": ["x", "y"]}, rows[1]]
+    assert load(updated, state) == [
+        {"chain_id": 1, "address": "0xa", "tvl": 1.0, "tags": ["x", "y"], DELETED_COLUMN: None},
+        {"chain_id": 2, "address": "0xa", "tvl": None, "tags": None, DELETED_COLUMN: True},
+    ]
+    assert sorted(values for _, values in state["table_rows"].values()) == [[1, "0xa"], [1, "0xb"]]
+
+
+def test_track_table_changes_null_and_separator_keys():
+    state = {}
+    rows = [
+        {"chain_id": None, "address": "0xa", "tvl": 1.0, "tags": None},
+        {"chain_id": 5, "address": "0x\x1fb", "tvl": 2.0, "tags": None},
+        {"chain_id": 5, "address": "0x", "tvl": 3.0, "tags": None},
+    ]
+    assert len(load(rows, state)) == 3
+    assert len(state["table_rows"]) == 3
+
+    deleted = load(rows[2:], state)
+    assert sorted(deleted, key=str) == sorted([
+        {"chain_id": None, "address": "0xa", DELETED_COLUMN: True},
+        {"chain_id": 5, "address": "0x\x1fb", DELETED_COLUMN: True},
+    ], key=str)
+
+
+def test_track_table_changes_empty_source_deletes_every_row():
+    state = {}
+    load([{"chain_id": 1, "address": "0xa", "tvl": 1.0, "tags": None}], state)
+
+    assert load([], state) == [{"chain_id": 1, "address": "0xa", DELETED_COLUMN: True}]
+    assert state["table_rows"] == {}
+
+
+def test_track_item_changes():
+    state = {}
+    rows = [
+        {"chain_id": 1, "address": "0xa", "tvl": 1.0},
+        {"chain_id": None, "address": "0xb", "tvl": 2.0},
+    ]
+    assert load_items(rows, state) == rows
+    assert load_items(rows, state) == []
+
+    updated = [{**rows[0], "tvl": 1.5}]
+    assert load_items(updated, state) == [
+        updated[0],
+        {"chain_id": None, "address": "0xb", DELETED_COLUMN: True},
+    ]
+    assert len(state["row_fingerprints"]) == 1
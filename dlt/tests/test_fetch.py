@@ -0,0 +1,91 @@
+import asyncio
+import httpx
+import pytest
+from lib import fetch
+from lib.metrics import HTTP_FETCH, REGISTRY
+
+URL = "https://api.beefy.finance/tvl"
+
+
+def run_with_transport(handler, coroutine_function):
+    """Run `coroutine_function` with the pooled HTTP client of its loop replaced by a MockTransport client."""
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        fetch._clients[asyncio.get_running_loop()] = client
+        try:
+            return await coroutine_function()
+        finally:
+            fetch._clients.clear()
+            fetch._host_semaphores.clear()
+            await client.aclose()
+
+    return asyncio.run(main())
+
+
+def conditional_handler(requests):
+    """200 with an ETag, then 304 when the ETag is sent back."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json={"vault": 1}, headers={"etag": '"v1"'})
+
+    return handler
+
+
+def test_fetch_url_json_dict_if_modified_reuses_etag():
+    requests = []
+    state = {}
+
+    async def fetch_twice():
+        return [await fetch.fetch_url_json_dict_if_modified(URL, state) for _ in range(2)]
+
+    first, second = run_with_transport(conditional_handler(requests), fetch_twice)
+
+    assert first == ({"vault": 1}, '"v1"')
+    assert second is None
+    assert "if-none-match" not in requests[0].headers
+    assert requests[1].headers["if-none-match"] == '"v1"'
+    assert state["http_validators"][URL]["etag"] == '"v1"'
+
+
+def test_stream_url_json_not_modified():
+    requests = []
+    state = {}
+
+    async def stream_twice():
+        results = []
+        for _ in range(2):
+            async with fetch.stream_url_json(URL, state) as stream:
+                if stream.not_modified:
+                    results.append(None)
+                else:
+                    results.append([entry async for entry in stream.kvitems()])
+        return results
+
+    first, second = run_with_transport(conditional_handler(requests), stream_twice)
+
+    assert first == [("vault", 1)]
+    assert second is None
+    assert requests[1].headers["if-none-match"] == '"v1"'
+
+
+def fetch_count(status):
+    HTTP_FETCH.export("test")
+    return REGISTRY.get_sample_value("dlt_http_fetches", {"pipeline": "test", "host": "api.beefy.finance", "status": status}) or 0
+
+
+def test_fetch_latency_by_status():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/down":
+            raise httpx.ConnectError("connection refused", request=request)
+        return httpx.Response(500)
+
+    before = {status: fetch_count(status) for status in ("500", "error")}
+    with pytest.raises(httpx.HTTPStatusError):
+        run_with_transport(handler, lambda: fetch.fetch_url_text(URL))
+    with pytest.raises(httpx.ConnectError):
+        run_with_transport(handler, lambda: fetch.fetch_url_text("https://api.beefy.finance/down"))
+
+    assert fetch_count("500") == before["500"] + 1
+    assert fetch_count("error") == before["error"] + 1
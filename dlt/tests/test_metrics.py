@@ -0,0 +1,29 @@
+from prometheus_client import generate_latest
+from lib.metrics import HTTP_FETCH, TABLE_ROWS, pipeline_registry, start_run
+
+
+def test_pipeline_registry_only_exports_its_pipeline():
+    TABLE_ROWS.labels(pipeline="beefy_api", table="tvl").set(10)
+    TABLE_ROWS.labels(pipeline="beefy_db", table="harvests").set(20)
+
+    exported = generate_latest(pipeline_registry("beefy_api")).decode()
+
+    assert 'dlt_table_rows{pipeline="beefy_api",table="tvl"} 10.0' in exported
+    assert "beefy_db" not in exported
+
+
+def test_run_summary_describes_the_last_run():
+    start_run("beefy_api")
+    HTTP_FETCH.observe(0.5, host="api.beefy.finance", status="200")
+    HTTP_FETCH.observe(1.5, host="api.beefy.finance", status="200")
+    HTTP_FETCH.export("beefy_api")
+    registry = pipeline_registry("beefy_api")
+    labels = {"pipeline": "beefy_api", "host": "api.beefy.finance", "status": "200"}
+
+    assert registry.get_sample_value("dlt_http_fetches", labels) == 2
+    assert registry.get_sample_value("dlt_http_fetch_seconds", {**labels, "stat": "sum"}) == 2.0
+    assert registry.get_sample_value("dlt_http_fetch_seconds", {**labels, "stat": "max"}) == 1.5
+
+    start_run("beefy_api")
+    HTTP_FETCH.export("beefy_api")
+    assert registry.get_sample_value("dlt_http_fetches", labels) is None
@@ -149,6 +149,7 @@ clickhouse-client \
     GRANT ${READ_PERM}                ON envio_poc3.*                TO dbt;
     GRANT ${READ_PERM}, ${WRITE_PERM} ON dbt.*                      TO dbt;
     GRANT ${READ_PERM}, ${WRITE_PERM} ON analytics.*                TO dbt;
+    GRANT SELECT                      ON system.query_log           TO dbt; -- per-model telemetry of the dbt scheduler
 
     -- grafana: R on dlt.*, dbt.*, analytics.*
     REVOKE ALL PRIVILEGES ON *.* FROM grafana;
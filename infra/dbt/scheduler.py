@@ -1,14 +1,44 @@
 #!/usr/bin/env python3
 """
 Scheduler for dbt models using APScheduler.
-Runs dbt models every 30 minutes.
+
+Only the models downstream of source tables with new data are run: the source tables of
+staging/dlt/sources.yml and staging/envio/sources.yml are polled for changes (latest block
+number of their ClickHouse parts, which moves on every insert but not on merges, and latest
+mutation, created by every delete), and a change marks `source:<source>.<table>+` as pending.
+The models no polled source table reaches (seeds, other sources) are still run every 30
+minutes by a fallback run, and a full run catches everything else once a day.
+
+Each source table has a resource class capping the dbt threads (concurrent model builds) of
+its run. Pending selections are coalesced in one dbt invocation per resource class, under the
+lock shared with manual runs: the classes with the most threads run first, without the models
+also downstream of a class with fewer threads, which are built once by that class' run. So a
+heavy model only throttles the models downstream of it. Failed selections are retried with an
+exponential backoff, a few times only: the daily full run catches the ones given up.
+
+dbt runs in this process (DBT_RUNNER_MODE=warm, the default) with a manifest parsed once
+and reused until a project file changes, or as `uv run dbt` per run (subprocess). Both
+log parse/compile/execute timings per run, and per-model telemetry is exposed as Prometheus
+metrics (see telemetry.py).
 """
+import fcntl
+import json
 import logging
 import subprocess
 import sys
 import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+import clickhouse_connect
+import yaml
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+import telemetry
 
 # Configure logging
 logging.basicConfig(
@@ -18,64 +48,462 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DBT_DIR = "/app/dbt"
+
+# seconds between two checks of the source tables
+POLL_INTERVAL = int(os.environ.get("DBT_POLL_INTERVAL", "60"))
+# models not downstream of a polled source table, at the cadence every model used to run at
+FALLBACK_RUN_CRON = os.environ.get("DBT_FALLBACK_RUN_CRON", "*/30 * * * *")
+# safety net for everything else (given up retries, tables without a signature)
+FULL_RUN_CRON = os.environ.get("DBT_FULL_RUN_CRON", "0 4 * * *")
+# a failed selection is retried after POLL_INTERVAL, doubled on each failure up to
+# DBT_RETRY_MAX_BACKOFF seconds, and given up (until new data or the full run) after DBT_RETRY_MAX retries
+RETRY_MAX = int(os.environ.get("DBT_RETRY_MAX", "5"))
+RETRY_MAX_BACKOFF = int(os.environ.get("DBT_RETRY_MAX_BACKOFF", "3600"))
+
+# "warm": dbtRunner in process with a cached manifest, "subprocess": run_dbt_with_lock.sh per run
+RUNNER_MODE = os.environ.get("DBT_RUNNER_MODE", "warm")
+# lock shared with run_dbt_with_lock.sh
+LOCKFILE = os.environ.get("DBT_RUN_LOCKFILE", "/app/dbt/.dbt_run.lock")
+LOCK_TIMEOUT = int(os.environ.get("DBT_RUN_LOCK_TIMEOUT", "30"))
+# project files and directories requiring a new parse when they change
+PROJECT_PATHS = ["dbt_project.yml", "packages.yml", "profiles.yml", "models", "macros", "seeds", "snapshots", "tests", "dbt_packages"]
+
+SOURCES_FILES = [
+    "models/staging/dlt/sources.yml",
+    "models/staging/envio/sources.yml",
+]
+
+# dbt threads per resource class, override with DBT_THREADS_<CLASS>
+RESOURCE_CLASS_THREADS = {
+    # large scans and aggregations over the time series
+    "timeseries": int(os.environ.get("DBT_THREADS_TIMESERIES", "2")),
+    # API snapshots, a few hours of data per run
+    "snapshots": int(os.environ.get("DBT_THREADS_SNAPSHOTS", "4")),
+    # small configuration tables
+    "configs": int(os.environ.get("DBT_THREADS_CONFIGS", "8")),
+}
+
+# (source, table prefix, resource class), first match wins
+SOURCE_RESOURCE_CLASSES = [
+    ("dlt", "beefy_db___", "timeseries"),
+    ("dlt", "beefy_api___", "snapshots"),
+    ("dlt", "github_files___", "configs"),
+    ("envio", "", "timeseries"),
+]
+DEFAULT_RESOURCE_CLASS = "timeseries"
+
+
+@dataclass(frozen=True)
+class SourceTable:
+    source: str
+    name: str
+    # ClickHouse database and table (dbt-clickhouse maps the source schema to the database)
+    database: str
+    identifier: str
+
+    @property
+    def selector(self) -> str:
+        return f"source:{self.source}.{self.name}+"
+
+    @property
+    def resource_class(self) -> str:
+        for source, prefix, resource_class in SOURCE_RESOURCE_CLASSES:
+            if self.source == source and self.name.startswith(prefix):
+                return resource_class
+        return DEFAULT_RESOURCE_CLASS
+
+
+def load_source_tables() -> list[SourceTable]:
+    """Source tables declared in SOURCES_FILES."""
+    tables = []
+    for path in SOURCES_FILES:
+        with open(os.path.join(DBT_DIR, path)) as f:
+            sources = yaml.safe_load(f).get("sources", [])
+        for source in sources:
+            for table in source.get("tables", []):
+                tables.append(SourceTable(
+                    source=source["name"],
+                    name=table["name"],
+                    database=source.get("schema", source["name"]),
+                    identifier=table.get("identifier", table["name"]),
+                ))
+    return tables
+
+
+# source tables waiting for a dbt run, the last change signature seen per table, and the
+# (failures, monotonic time of the next retry) of the tables whose last run failed
+_pending: set[SourceTable] = set()
+_signatures: dict[SourceTable, tuple] = {}
+_failures: dict[SourceTable, tuple[int, float]] = {}
+_state_lock = threading.Lock()
+_clickhouse_client = None
+
+
+def _get_clickhouse_client():
+    global _clickhouse_client
+    if _clickhouse_client is None:
+        _clickhouse_client = clickhouse_connect.get_client(
+            host=os.environ.get("DBT_CLICKHOUSE_HOST", "clickhouse"),
+            port=int(os.environ.get("DBT_CLICKHOUSE_PORT", "8123")),
+            username=os.environ.get("DBT_CLICKHOUSE_USER", "dbt"),
+            password=os.environ.get("DBT_CLICKHOUSE_PASSWORD", ""),
+        )
+    return _clickhouse_client
+
+
+def table_signatures(tables: list[SourceTable]) -> dict[tuple[str, str], tuple]:
+    """
+    (max block number of the active parts, latest mutation) per (database, table).
+
+    Block numbers grow with every insert and are kept by merges. The row count is not part of
+    the signature: merges of the ReplacingMergeTree tables collapse duplicates and change it
+    without new data. Deletes (ALTER DELETE and lightweight DELETE) rewrite parts under the same
+    block numbers, they are caught by the creation time of the latest mutation of the table.
+    Tables without parts (views, other engines) are missing and never trigger a run.
+    """
+    result = _get_clickhouse_client().query(
+        """
+        SELECT database, table, block, created_at
+        FROM (
+            SELECT database, table, max(max_block_number) AS block
+            FROM system.parts
+            WHERE active AND database IN {databases:Array(String)}
+            GROUP BY database, table
+        ) AS parts
+        LEFT JOIN (
+            SELECT database, table, max(create_time) AS created_at
+            FROM system.mutations
+            WHERE database IN {databases:Array(String)}
+            GROUP BY database, table
+        ) AS mutations USING (database, table)
+        """,
+        parameters={"databases": sorted({table.database for table in tables})},
+    )
+    return {(database, table): (block, mutation) for database, table, block, mutation in result.result_rows}
 
-def run_dbt():
-    """Run dbt models."""
+
+def poll_source_tables(tables: list[SourceTable]):
+    """Mark the source tables with new data as pending."""
     try:
-        logger.info("Starting dbt run...")
-        
-        # Set working directory to dbt project
-        dbt_dir = "/app/dbt"
-        os.chdir(dbt_dir)
-        
-        os.environ["DBT_PROFILES_DIR"] = dbt_dir
-        os.environ["DBT_PROJECT_DIR"] = dbt_dir
-        
-        # Check if dbt_packages exists and is not empty
-        dbt_packages_dir = os.path.join(dbt_dir, "dbt_packages")
-        if not os.path.exists(dbt_packages_dir) or not os.listdir(dbt_packages_dir):
-            logger.info("dbt_packages empty, running 'dbt deps'...")
-            deps_result = subprocess.run(
-                ["uv", "run", "dbt", "deps"],
-                cwd=dbt_dir,
-            )
-            if deps_result.returncode != 0:
-                logger.error("Error running 'dbt deps'")
-                return
-        
-        # Run dbt under lock so manual "make dbt run" and scheduler don't clash
-        result = subprocess.run(
-            ["/app/run_dbt_with_lock.sh", "run", "--show-all-deprecations"],
-            cwd=dbt_dir,
+        signatures = table_signatures(tables)
+    except Exception as e:
+        logger.warning(f"Could not read the source table signatures: {e}")
+        return
+
+    with _state_lock:
+        for table in tables:
+            signature = signatures.get((table.database, table.identifier))
+            if signature is None or _signatures.get(table) == signature:
+                continue
+            if table in _signatures:
+                logger.info(f"New data in {table.source}.{table.name}")
+            _signatures[table] = signature
+            _pending.add(table)
+
+
+def ensure_dbt_deps() -> bool:
+    """Run 'dbt deps' when dbt_packages is missing."""
+    dbt_packages_dir = os.path.join(DBT_DIR, "dbt_packages")
+    if not os.path.exists(dbt_packages_dir) or not os.listdir(dbt_packages_dir):
+        logger.info("dbt_packages empty, running 'dbt deps'...")
+        deps_result = subprocess.run(
+            ["uv", "run", "dbt", "deps"],
+            cwd=DBT_DIR,
+        )
+        if deps_result.returncode != 0:
+            logger.error("Error running 'dbt deps'")
+            return False
+    return True
+
+
+@dataclass
+class RunTimings:
+    """Wall clock of a dbt run, and where it went. Compile and execute are summed over the models."""
+
+    total: float = 0.0
+    parse: Optional[float] = None
+    compile: float = 0.0
+    execute: float = 0.0
+    models: int = 0
+
+    def add_timing(self, name: str, started_at: Optional[datetime], completed_at: Optional[datetime]):
+        if started_at is None or completed_at is None:
+            return
+        if name == "compile":
+            self.compile += (completed_at - started_at).total_seconds()
+        elif name == "execute":
+            self.execute += (completed_at - started_at).total_seconds()
+
+    def add_run_results(self, path: str):
+        """Add the model timings of a run_results.json artifact, the parse is what the run spent outside of dbt's execution."""
+        with open(path) as f:
+            run_results = json.load(f)
+        results = run_results["results"]
+        self.parse = max(self.total - run_results["elapsed_time"], 0.0)
+        self.models = len(results)
+        for result in results:
+            for timing in result.get("timing", []):
+                self.add_timing(
+                    timing["name"],
+                    datetime.fromisoformat(timing["started_at"]) if timing.get("started_at") else None,
+                    datetime.fromisoformat(timing["completed_at"]) if timing.get("completed_at") else None,
+                )
+
+    def log(self):
+        parse = "cached" if self.parse is None else f"{self.parse:.1f}s"
+        logger.info(
+            f"dbt run timings: {self.models} models, total {self.total:.1f}s, "
+            f"parse {parse}, compile {self.compile:.1f}s, execute {self.execute:.1f}s"
         )
-        
-        if result.returncode == 0:
+
+
+@contextmanager
+def run_lock():
+    """The lock of run_dbt_with_lock.sh (flock), so manual "make dbt run" and the scheduler don't clash."""
+    os.makedirs(os.path.dirname(LOCKFILE), exist_ok=True)
+    with open(LOCKFILE, "a") as f:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (fcntl.LOCK_NB if LOCK_TIMEOUT > 0 else 0))
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"dbt run lock {LOCKFILE} held for more than {LOCK_TIMEOUT}s")
+                time.sleep(1)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class WarmDbt:
+    """dbt invoked in process, reusing its parsed manifest until a project file changes."""
+
+    def __init__(self):
+        self.manifest = None
+        self.project_mtime: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def _project_mtime(self) -> float:
+        latest = 0.0
+        for path in PROJECT_PATHS:
+            full_path = os.path.join(DBT_DIR, path)
+            if os.path.isfile(full_path):
+                latest = max(latest, os.path.getmtime(full_path))
+            for root, _, files in os.walk(full_path):
+                for name in files:
+                    latest = max(latest, os.path.getmtime(os.path.join(root, name)))
+        return latest
+
+    def _parse(self, timings: RunTimings) -> bool:
+        """Parse the project if it changed, partial parsing keeps this incremental."""
+        from dbt.cli.main import dbtRunner
+
+        project_mtime = self._project_mtime()
+        if self.manifest is not None and project_mtime == self.project_mtime:
+            return True
+
+        started_at = time.perf_counter()
+        result = dbtRunner().invoke(["parse"])
+        timings.parse = time.perf_counter() - started_at
+        if not result.success:
+            logger.error(f"dbt parse failed: {result.exception}")
+            return False
+        self.manifest = result.result
+        self.project_mtime = project_mtime
+        return True
+
+    def run(self, *args: str) -> tuple[bool, RunTimings]:
+        from dbt.cli.main import dbtRunner
+
+        with self.lock, run_lock():
+            timings = RunTimings()
+            started_at = time.perf_counter()
+            if not self._parse(timings):
+                timings.total = time.perf_counter() - started_at
+                return False, timings
+
+            result = dbtRunner(manifest=self.manifest).invoke(["run", *args])
+            timings.total = time.perf_counter() - started_at
+            if result.result is not None:
+                timings.models = len(result.result.results)
+                for model_result in result.result.results:
+                    for timing in model_result.timing:
+                        timings.add_timing(timing.name, timing.started_at, timing.completed_at)
+            timings.log()
+            if result.exception is not None:
+                logger.error(f"dbt run failed: {result.exception}")
+            return result.success, timings
+
+
+_warm_dbt = WarmDbt()
+
+
+def run_dbt_subprocess(*args: str) -> tuple[bool, RunTimings]:
+    """Run dbt with `args` in a `uv run dbt` process."""
+    started_at = time.perf_counter()
+    # Run dbt under lock so manual "make dbt run" and scheduler don't clash
+    result = subprocess.run(
+        ["/app/run_dbt_with_lock.sh", "run", *args],
+        cwd=DBT_DIR,
+    )
+    timings = RunTimings(total=time.perf_counter() - started_at)
+    try:
+        timings.add_run_results(os.path.join(DBT_DIR, "target", "run_results.json"))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not read the dbt run results: {e}")
+    timings.log()
+    return result.returncode == 0, timings
+
+
+def run_dbt(*args: str) -> bool:
+    """Run dbt with `args`."""
+    try:
+        # Set working directory to dbt project
+        os.chdir(DBT_DIR)
+
+        os.environ["DBT_PROFILES_DIR"] = DBT_DIR
+        os.environ["DBT_PROJECT_DIR"] = DBT_DIR
+
+        if not ensure_dbt_deps():
+            return False
+
+        args = ("--show-all-deprecations", *args)
+        started_at = time.time()
+        success, timings = _warm_dbt.run(*args) if RUNNER_MODE == "warm" else run_dbt_subprocess(*args)
+        telemetry.record_run(timings, success)
+        telemetry.record_models(os.path.join(DBT_DIR, "target", "run_results.json"), started_at)
+        if success:
             logger.info("dbt run completed successfully")
-        else:
-            logger.error("dbt run failed")
-            
+            return True
+        logger.error("dbt run failed")
+        return False
+
     except Exception as e:
         logger.error(f"Error running dbt: {e}", exc_info=True)
+        return False
+
+
+def _record_failure(tables: list[SourceTable]):
+    """Schedule the retry of failed source tables, or give up on them after RETRY_MAX retries."""
+    now = time.monotonic()
+    with _state_lock:
+        for table in tables:
+            failures = _failures.get(table, (0, 0.0))[0] + 1
+            if failures > RETRY_MAX:
+                logger.error(f"Giving up on {table.selector} after {RETRY_MAX} retries, left to the full run")
+                del _failures[table]
+                continue
+            backoff = min(POLL_INTERVAL * 2 ** (failures - 1), RETRY_MAX_BACKOFF)
+            _failures[table] = (failures, now + backoff)
+            _pending.add(table)
+            logger.info(f"Retrying {table.selector} in {backoff}s (retry {failures}/{RETRY_MAX})")
+
+
+def class_runs(tables: list[SourceTable]) -> list[tuple[str, list[SourceTable], list[SourceTable]]]:
+    """
+    (resource class, its tables, tables of the classes with fewer threads) per dbt invocation.
+
+    Invocations run in this order, the most threads first, each one excluding the models
+    downstream of the tables of the next ones: a model is built once, with the threads of the
+    heaviest class it depends on, after the models of the lighter classes it reads.
+    """
+    by_class: dict[str, list[SourceTable]] = {}
+    for table in tables:
+        by_class.setdefault(table.resource_class, []).append(table)
+    ordered = sorted(by_class, key=lambda resource_class: (-RESOURCE_CLASS_THREADS[resource_class], resource_class))
+    return [
+        (resource_class, by_class[resource_class], [table for heavier in ordered[i + 1:] for table in by_class[heavier]])
+        for i, resource_class in enumerate(ordered)
+    ]
+
+
+def run_pending(tables: list[SourceTable]):
+    """Poll the source tables, then run the models downstream of the changed ones, one dbt invocation per resource class."""
+    telemetry.collect_query_log(_get_clickhouse_client())
+    poll_source_tables(tables)
+    now = time.monotonic()
+    with _state_lock:
+        # tables backing off from a failed run wait for their retry time, even with new data
+        changed = sorted((table for table in _pending if _failures.get(table, (0, 0.0))[1] <= now), key=lambda table: table.selector)
+        _pending.difference_update(changed)
+    if not changed:
+        return
+
+    for resource_class, class_tables, heavier in class_runs(changed):
+        threads = RESOURCE_CLASS_THREADS[resource_class]
+        args = ["--select", *[table.selector for table in class_tables], "--threads", str(threads)]
+        if heavier:
+            args += ["--exclude", *[table.selector for table in heavier]]
+        logger.info(f"Starting {resource_class} dbt run for {len(class_tables)} changed source tables ({threads} threads)...")
+        if run_dbt(*args):
+            with _state_lock:
+                for table in class_tables:
+                    _failures.pop(table, None)
+        else:
+            _record_failure(class_tables)
+
+
+def run_fallback():
+    """
+    Run the models no polled source table reaches: seeds, sources outside SOURCES_FILES, tables
+    without a signature yet. Views downstream of polled tables (and their now() windows) are
+    evaluated at query time, so they need no periodic run.
+    """
+    with _state_lock:
+        tracked = sorted(table.selector for table in _signatures)
+    logger.info(f"Starting fallback dbt run ({len(tracked)} polled source selections excluded)...")
+    run_dbt(*(("--exclude", *tracked) if tracked else ()))
+
+
+def run_full():
+    """Run all dbt models."""
+    logger.info("Starting full dbt run...")
+    if run_dbt():
+        with _state_lock:
+            _failures.clear()
 
 
 if __name__ == "__main__":
-    logger.info("Starting dbt scheduler (runs every 30 minutes)...")
-    
+    source_tables = load_source_tables()
+    logger.info(f"Starting dbt scheduler ({len(source_tables)} source tables polled every {POLL_INTERVAL}s)...")
+
+    telemetry.start_metrics_server()
     scheduler = BlockingScheduler()
-    
-    # Schedule dbt to run every 30 minutes
+
+    # the first poll marks every tracked table as pending, data may have landed while the scheduler was down
+    scheduler.add_job(
+        run_pending,
+        args=[source_tables],
+        trigger=IntervalTrigger(seconds=POLL_INTERVAL),
+        id="dbt_run_pending",
+        name="dbt Run (changed sources)",
+        max_instances=1,  # Prevent overlapping runs
+        coalesce=True,   # Combine multiple pending runs into one
+    )
+
     scheduler.add_job(
-        run_dbt,
-        trigger=CronTrigger(minute="*/30"),
+        run_fallback,
+        trigger=CronTrigger.from_crontab(FALLBACK_RUN_CRON),
+        id="dbt_run_fallback",
+        name="dbt Run (models without a polled source)",
+        max_instances=1,  # Prevent overlapping runs
+        coalesce=True,   # Combine multiple pending runs into one
+    )
+
+    scheduler.add_job(
+        run_full,
+        trigger=CronTrigger.from_crontab(FULL_RUN_CRON),
         id="dbt_run",
         name="dbt Run",
         max_instances=1,  # Prevent overlapping runs
         coalesce=True,   # Combine multiple pending runs into one
     )
-    
+
     try:
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
         logger.info("Scheduler stopped")
         scheduler.shutdown()
-
@@ -0,0 +1,184 @@
+"""
+Per-model telemetry of the dbt runs, exposed as Prometheus metrics.
+
+Model status and execution time come from run_results.json, the ClickHouse resources from
+system.query_log: dbt prefixes every query with a comment holding the invocation_id of the
+run and the node_id of its model (see macros/query_comment.sql in the dbt project), which
+attribute the queries to their run and model, even with concurrent or manual runs.
+
+system.query_log is flushed every 7.5s by default, so the ClickHouse resources of a run are
+collected on a later scheduler tick (see `collect_query_log`) rather than waited for after
+the run, which would hold the scheduler job.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+from prometheus_client import Counter, Gauge, start_http_server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get("DBT_METRICS_PORT", "9102"))
+# seconds after a run before its queries are read from system.query_log (flush_interval_milliseconds)
+QUERY_LOG_FLUSH_SECONDS = float(os.environ.get("DBT_QUERY_LOG_FLUSH_SECONDS", "10"))
+
+RUNS = Counter("dbt_runs_total", "dbt runs", ["status"])
+RUN_SECONDS = Gauge("dbt_run_seconds", "Wall clock of the last dbt run, and its parse, compile and execute time", ["phase"])
+
+MODEL_SUCCESS = Gauge("dbt_model_success", "1 if the last run of the model succeeded", ["model"])
+MODEL_LAST_RUN = Gauge("dbt_model_last_run_timestamp_seconds", "Time of the last run of the model", ["model"])
+MODEL_ELAPSED = Gauge("dbt_model_elapsed_seconds", "Execution time of the last run of the model", ["model"])
+MODEL_QUERY_SECONDS = Gauge("dbt_model_query_seconds", "ClickHouse query time of the last run of the model", ["model"])
+MODEL_READ_ROWS = Gauge("dbt_model_read_rows", "Rows read by the last run of the model", ["model"])
+MODEL_READ_BYTES = Gauge("dbt_model_read_bytes", "Bytes read by the last run of the model", ["model"])
+MODEL_WRITTEN_ROWS = Gauge("dbt_model_written_rows", "Rows written by the last run of the model", ["model"])
+MODEL_MEMORY_USAGE = Gauge("dbt_model_memory_usage_bytes", "Peak memory of a query of the last run of the model", ["model"])
+
+# query_log_stats column of each per-model ClickHouse gauge
+MODEL_QUERY_GAUGES = {
+    "query_seconds": MODEL_QUERY_SECONDS,
+    "read_rows": MODEL_READ_ROWS,
+    "read_bytes": MODEL_READ_BYTES,
+    "written_rows": MODEL_WRITTEN_ROWS,
+    "memory_usage": MODEL_MEMORY_USAGE,
+}
+MODEL_GAUGES = (MODEL_SUCCESS, MODEL_LAST_RUN, MODEL_ELAPSED, *MODEL_QUERY_GAUGES.values())
+
+QUERY_LOG_SQL = """
+SELECT
+    extract(query, '"node_id": "([^"]+)"') AS node_id,
+    sum(query_duration_ms) / 1000 AS query_seconds,
+    sum(read_rows) AS read_rows,
+    sum(read_bytes) AS read_bytes,
+    sum(written_rows) AS written_rows,
+    max(memory_usage) AS memory_usage
+FROM system.query_log
+WHERE type = 'QueryFinish'
+  AND event_date >= toDate(toDateTime({since:UInt32}))
+  AND event_time >= toDateTime({since:UInt32})
+  AND user = currentUser()
+  AND query LIKE concat('%"invocation_id": "', {invocation_id:String}, '"%')
+  AND query LIKE '%"node_id"%'
+GROUP BY node_id
+"""
+
+
+def start_metrics_server():
+    start_http_server(METRICS_PORT)
+    logger.info(f"dbt metrics exposed on :{METRICS_PORT}/metrics")
+
+
+def _model_name(unique_id: str) -> str:
+    # model.<project>.<name>
+    return unique_id.split(".")[-1]
+
+
+def record_run(timings: Any, success: bool):
+    """Record the run level timings (see scheduler.RunTimings)."""
+    RUNS.labels(status="success" if success else "error").inc()
+    RUN_SECONDS.labels(phase="total").set(timings.total)
+    if timings.parse is not None:
+        RUN_SECONDS.labels(phase="parse").set(timings.parse)
+    RUN_SECONDS.labels(phase="compile").set(timings.compile)
+    RUN_SECONDS.labels(phase="execute").set(timings.execute)
+
+
+def query_log_stats(client: Any, invocation_id: str, since: float) -> dict[str, dict[str, float]]:
+    """ClickHouse resources used per dbt node by the `invocation_id` run, started at the `since` timestamp."""
+    result = client.query(QUERY_LOG_SQL, parameters={"invocation_id": invocation_id, "since": int(since)})
+    return {row[0]: dict(zip(result.column_names[1:], row[1:])) for row in result.result_rows if row[0]}
+
+
+@dataclass
+class PendingRun:
+    """A run whose query_log stats are not collected yet."""
+    invocation_id: str
+    started_at: float
+    finished_at: float
+    # unique_id -> model name of the models that ran queries (skipped ones did not)
+    executed: dict[str, str]
+
+
+_pending_runs: list[PendingRun] = []
+# models with series in the MODEL_GAUGES
+_models: set[str] = set()
+_lock = threading.Lock()
+
+
+def _remove_series(model: str, gauges=MODEL_GAUGES):
+    for gauge in gauges:
+        try:
+            gauge.remove(model)
+        except KeyError:
+            pass
+
+
+def record_models(run_results_path: str, since: float):
+    """
+    Record the per-model metrics of the run started at the `since` timestamp, its ClickHouse
+    resources are collected later by `collect_query_log`.
+
+    Models skipped by the run lose their ClickHouse series (they ran no query), and a run
+    without a selection drops the series of the models it did not run (removed from the project).
+    """
+    try:
+        if os.path.getmtime(run_results_path) < since:
+            logger.warning("run_results.json was not written by the last run, no model metrics")
+            return
+        with open(run_results_path) as f:
+            run_results = json.load(f)
+        results = run_results["results"]
+        invocation_id = run_results["metadata"]["invocation_id"]
+        args = run_results.get("args", {})
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not read the dbt run results: {e}")
+        return
+
+    now = time.time()
+    executed = {}
+    with _lock:
+        models = set()
+        for result in results:
+            unique_id = result["unique_id"]
+            if not unique_id.startswith("model."):
+                continue
+            model = _model_name(unique_id)
+            models.add(model)
+            MODEL_SUCCESS.labels(model=model).set(1 if result["status"] == "success" else 0)
+            MODEL_LAST_RUN.labels(model=model).set(now)
+            MODEL_ELAPSED.labels(model=model).set(result.get("execution_time") or 0)
+            if result["status"] in ("success", "error"):
+                executed[unique_id] = model
+            else:
+                _remove_series(model, MODEL_QUERY_GAUGES.values())
+
+        if not args.get("select") and not args.get("exclude"):
+            for model in _models - models:
+                _remove_series(model)
+            _models.clear()
+        _models.update(models)
+        _pending_runs.append(PendingRun(invocation_id, since, now, executed))
+
+
+def collect_query_log(client: Any):
+    """Record the ClickHouse resources of the models of the runs finished QUERY_LOG_FLUSH_SECONDS ago."""
+    with _lock:
+        due = [run for run in _pending_runs if time.time() - run.finished_at >= QUERY_LOG_FLUSH_SECONDS]
+        _pending_runs[:] = [run for run in _pending_runs if run not in due]
+
+    for run in due:
+        try:
+            stats = query_log_stats(client, run.invocation_id, run.started_at)
+        except Exception as e:
+            logger.warning(f"Could not read system.query_log: {e}")
+            continue
+        with _lock:
+            for unique_id, model in run.executed.items():
+                model_stats = stats.get(unique_id)
+                if model_stats is None or model not in _models:
+                    continue
+                for column, gauge in MODEL_QUERY_GAUGES.items():
+                    gauge.labels(model=model).set(model_stats[column])
@@ -2,11 +2,24 @@
 """
 Scheduler for DLT pipelines using APScheduler.
 Runs three separate DLT pipelines on different schedules.
+
+DLT_SCHEDULER_MODE selects how a pipeline run is executed:
+- "subprocess" (default): `uv run ./<name>_pipeline.py` per run
+- "warm": a long-lived worker process per pipeline imports the pipeline once and runs
+  its `main()` on every trigger. The worker is replaced after a failure or a timeout.
+  Requires the scheduler to run in the dlt project environment (`uv run` from /app/dlt).
 """
 from __future__ import annotations
 import logging
 import asyncio
+import importlib
+import multiprocessing
+import os
 import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
@@ -24,9 +37,121 @@ TASK_TIMEOUT = 60 * 30  # 30 minutes timeout max
 # Path to the dlt directory (assuming scheduler runs from /app/infra/dlt, dlt code is in /app/dlt)
 DLT_DIR = Path("/app/dlt")
 
+SCHEDULER_MODE = os.environ.get("DLT_SCHEDULER_MODE", "subprocess")
+
+# seconds the warm worker took to import its pipeline, reported with its first run
+_warm_up_seconds: float | None = None
+
+def _warm_up(module_name: str):
+    """Warm worker initializer: import the pipeline (dlt, sqlalchemy, pyarrow, sources) once."""
+    global _warm_up_seconds
+    started_at = time.perf_counter()
+    os.chdir(DLT_DIR)
+    sys.path.insert(0, str(DLT_DIR))
+    sys.argv = [f"{module_name}.py"]
+
+    from lib.config import configure_env
+    configure_env()
+    importlib.import_module(module_name)
+    _warm_up_seconds = time.perf_counter() - started_at
+
+def _run_main(module_name: str) -> dict:
+    """Run the pipeline `main()` in the warm worker."""
+    global _warm_up_seconds
+    from lib.cli import mark_run_start
+
+    mark_run_start()
+    started_at = time.perf_counter()
+    asyncio.run(importlib.import_module(module_name).main())
+    metrics = {"warm_up_seconds": _warm_up_seconds, "run_seconds": time.perf_counter() - started_at}
+    _warm_up_seconds = None
+    return metrics
+
+class WarmWorker:
+    """A long-lived process running one pipeline, started on first use and replaced after a failure."""
+
+    def __init__(self, script_name: str):
+        self.script_name = script_name
+        self.module_name = Path(script_name).stem
+        self.executor: ProcessPoolExecutor | None = None
+
+    def _start(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # spawn: a fresh interpreter, not a fork of the scheduler event loop
+            self.executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up,
+                initargs=(self.module_name,),
+            )
+        return self.executor
+
+    def _discard(self):
+        """
+        Kill the worker process, the next run starts a new one.
+
+        ProcessPoolExecutor has no public API to kill a busy worker (shutdown waits for the
+        running task), so this relies on its private `_processes` dict (pid -> Process), stable
+        since Python 3.2. If it ever goes away the worker is only shut down, and a hung run
+        keeps its process until it returns.
+        """
+        if self.executor is None:
+            return
+        # None or empty once the pool is broken (the worker already died)
+        processes = getattr(self.executor, "_processes", None) or {}
+        for process in list(processes.values()):
+            process.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    async def run(self):
+        logger.info(f"Starting {self.script_name} pipeline run (warm worker)...")
+        started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            async with asyncio.timeout(TASK_TIMEOUT):
+                metrics = await loop.run_in_executor(self._start(), _run_main, self.module_name)
+        except TimeoutError:
+            logger.error(f"{self.script_name} pipeline timed out, killing its worker")
+            self._discard()
+            return
+        except BrokenProcessPool:
+            logger.error(f"{self.script_name} worker died, restarting it on the next run")
+            self._discard()
+            return
+        except Exception:
+            logger.exception(f"{self.script_name} pipeline failed, restarting its worker on the next run")
+            self._discard()
+            return
+
+        total_seconds = time.perf_counter() - started_at
+        if metrics["warm_up_seconds"] is not None:
+            logger.info(f"{self.script_name} worker startup: {metrics['warm_up_seconds']:.2f}s (paid once per worker)")
+        logger.info(
+            f"{self.script_name} pipeline run completed successfully: "
+            f"total {total_seconds:.2f}s, run {metrics['run_seconds']:.2f}s"
+        )
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+_warm_workers: dict[str, WarmWorker] = {}
+
+async def run_pipeline(script_name: str):
+    """Run a pipeline in the configured DLT_SCHEDULER_MODE."""
+    if SCHEDULER_MODE == "warm":
+        if script_name not in _warm_workers:
+            _warm_workers[script_name] = WarmWorker(script_name)
+        await _warm_workers[script_name].run()
+    else:
+        await run_pipeline_script(script_name)
+
 async def run_pipeline_script(script_name: str):
     """Run a pipeline script using uv run."""
     process = None
+    started_at = time.perf_counter()
     try:
         logger.info(f"Starting {script_name} pipeline run...")
         # Change to the dlt directory and run the script
@@ -42,7 +167,7 @@ async def run_pipeline_script(script_name: str):
             await process.wait()
         
         if process.returncode == 0:
-            logger.info(f"{script_name} pipeline run completed successfully")
+            logger.info(f"{script_name} pipeline run completed successfully: total {time.perf_counter() - started_at:.2f}s")
         else:
             logger.error(f"{script_name} pipeline failed with return code {process.returncode}")
     finally:
@@ -57,19 +182,19 @@ async def run_pipeline_script(script_name: str):
 
 async def beefy_api_pipeline():
     """Run the beefy_api pipeline."""
-    await run_pipeline_script("beefy_api_pipeline.py")
+    await run_pipeline("beefy_api_pipeline.py")
 
 async def beefy_db_pipeline():
     """Run the beefy_db pipeline."""
-    await run_pipeline_script("beefy_db_pipeline.py")
+    await run_pipeline("beefy_db_pipeline.py")
 
 async def github_files_pipeline():
     """Run the github_files pipeline."""
-    await run_pipeline_script("github_files_pipeline.py")
+    await run_pipeline("github_files_pipeline.py")
 
 async def main():
     """Main async function to run the scheduler."""
-    logger.info("Starting DLT scheduler with 3 pipeline tasks...")
+    logger.info(f"Starting DLT scheduler with 3 pipeline tasks ({SCHEDULER_MODE} mode)...")
     
     scheduler = AsyncIOScheduler()
 
@@ -111,6 +236,8 @@ async def main():
     except (KeyboardInterrupt, SystemExit):
         logger.info("Shutting down scheduler...")
         scheduler.shutdown()
+        for worker in _warm_workers.values():
+            worker.shutdown()
 
 
 if __name__ == "__main__":